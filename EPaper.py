@@ -1,7 +1,18 @@
-from PIL import Image, ImageFont
+from PIL import Image
 import threading
+import queue
+import collections
+from concurrent.futures import Future
 from lib import epd2in13_V4
 from lib import gt1151
+from lib import framebuffer
+from lib import metrics
+from lib import tracing
+from screens import ScreenCache
+import drawing
+from glyphs import GlyphAtlas, LazyFont
+from compositor import Compositor
+from surfaces import SurfaceManager
 import os
 import time
 import io
@@ -16,17 +27,26 @@ class EPaperInterface():
     # https://www.waveshare.com/wiki/2.13inch_Touch_e-Paper_HAT_Manual#Raspberry_Pi
 
     # hardware and library constants
-    MAX_PARTIAL_REFRESHES = 30
+    # changed pixels partial refreshes may accumulate before ghosting needs a
+    # full refresh, three whole screens' worth
+    GHOSTING_BUDGET = 3 * epd2in13_V4.EPD_WIDTH * epd2in13_V4.EPD_HEIGHT
+    # wait for a moment without touches before a due full refresh
+    DEFER_FULL_REFRESH = True
+    IDLE_INTERVAL = 10
     MAX_REFRESH_INTERVAL = 24 * 60 * 60
     MIN_REFRESH_INTERVAL = 1
     TIMEOUT_INTERVAL = 120
+    # blank the panel before it goes to sleep, otherwise it keeps showing the
+    # last frame and waking only has to reload it into RAM
+    CLEAR_ON_SLEEP = False
+    TOUCH_QUEUE_SIZE = 64
 
     # gesture enums
     SWIPE_LEFT = "left"
     SWIPE_RIGHT = "right"
 
-    FONT_15 = ImageFont.truetype(os.path.join(fontdir, 'Font.ttc'), 15)
-    FONT_12 = ImageFont.truetype(os.path.join(fontdir, 'Font.ttc'), 12)
+    FONT_15 = LazyFont(os.path.join(fontdir, 'Font.ttc'), 15)
+    FONT_12 = LazyFont(os.path.join(fontdir, 'Font.ttc'), 12)
 
     def __init__(self):
         try:
@@ -36,13 +56,41 @@ class EPaperInterface():
             self.touch_interface = gt1151.GT1151()
             self.touch_interface_dev = gt1151.GT_Development()
             self.touch_interface_old = gt1151.GT_Development()
+            self.touch_queue = queue.Queue(maxsize=EPaperInterface.TOUCH_QUEUE_SIZE)
+            self.touch_lock = threading.Lock()
+            self.touch_listeners = []
+            # the display thread shows the front canvas, uploads land in
+            # the back frame and are swapped in under render_condition
             self.canvas = None
+            self.back_frame = None
+            self.render_condition = threading.Condition()
+            self.draw_lock = threading.Lock()
+            self.coalesced_frames = 0
+            # hardware commands run on the display thread, see submit
+            self.commands = collections.deque()
+            self.last_buffer = None
+            self.last_buffer_digest = None
+            self.screens = ScreenCache(
+                framebuffer.FramePacker(self.width, self.height))
+            self.compositor = Compositor(
+                framebuffer.FramePacker(self.width, self.height))
+            self.surfaces = SurfaceManager(
+                framebuffer.FramePacker(self.width, self.height))
+            # loaded on the first draw, see glyph_atlases
+            self._glyph_atlases = None
+            self.glyph_atlas_lock = threading.Lock()
+            # set by the display thread once the panel and touch are up
+            self.ready = threading.Event()
+            self.startup_error = None
+            self.rendered_frames = 0
+            self.skipped_frames = 0
             self.touch_flag = True
             self.display_thread_flag = True
             self.app_is_running = True
             self.screen_is_active = True
-            self.should_render = False
+            self.wake_requested = False
             self.partial_refresh_counter = 0
+            self.ghosting_pixels = 0
             self.last_full_refresh = time.time()
 
             # touch event attributes
@@ -53,24 +101,26 @@ class EPaperInterface():
             self.touch_start_y = None
             self.touch_end_x = None
             self.touch_end_y = None
+            self.touch_last_x = None
+            self.touch_last_y = None
             self.did_swipe = False
             self.swipe_direction = None
             self.did_tap = False
             self.tap_x = None
             self.tap_y = None
+            # taps and swipes detect_screen_interaction hasn't returned yet
+            self.unread_gestures = {}
+            self.unread_gestures_lock = threading.Lock()
 
-            self.base_touch_thread = threading.Thread(
-                daemon=True, target=self.base_touch_loop)
+            self.touch_event_thread = threading.Thread(
+                daemon=True, target=self.touch_event_loop)
             self.display_thread = threading.Thread(
                 daemon=False, target=self.display_loop)
 
+            # the panel is brought up by the display thread, see start_display
             self.reset_canvas()
-            self.display.init(self.display.FULL_UPDATE)
-            self.display.displayPartBaseImage(
-                self.display.getbuffer(self.canvas))
-            self.touch_interface.GT_Init()
 
-            self.base_touch_thread.start()
+            self.touch_event_thread.start()
             self.display_thread.start()
 
         except KeyboardInterrupt:
@@ -79,50 +129,256 @@ class EPaperInterface():
         except Exception as e:
             print("An error occured in the EPaperInterface. Exception was:" + str(e))
 
-    def base_touch_loop(self):
-        while self.touch_flag:
-            if (self.touch_interface.digital_read(self.touch_interface.INT) == 0):
-                self.touch_interface_dev.Touch = 1
-            else:
-                self.touch_interface_dev.Touch = 0
-            time.sleep(0.02)
+    @property
+    def glyph_atlases(self):
+        with self.glyph_atlas_lock:
+            if self._glyph_atlases is None:
+                self._glyph_atlases = {12: GlyphAtlas(EPaperInterface.FONT_12),
+                                       15: GlyphAtlas(EPaperInterface.FONT_15)}
+            return self._glyph_atlases
+
+    def health(self):
+        return {"ready": self.ready.is_set(),
+                "error": self.startup_error}
+
+    def on_touch_interrupt(self):
+        # runs on the GPIO event thread for every falling edge of INT
+        if not self.touch_flag:
+            return
+        if not self.screen_is_active and not self.wake_requested:
+            # start waking the panel before the touch is even decoded. Checked
+            # again under the lock, awaken may have finished in between
+            with self.render_condition:
+                if not self.screen_is_active:
+                    self.wake_requested = True
+                    self.render_condition.notify()
+        dev = self.touch_interface_dev
+        # every report starts a trace when tracing is on
+        trace_id = tracing.new_trace()
+        with self.touch_lock, tracing.context(trace_id):
+            dev.Touch = 1
+            if not self.touch_interface.GT_Scan(dev, self.touch_interface_old):
+                metrics.TOUCH_SAMPLES.labels('empty').inc()
+                return
+            sample = (dev.TouchCount, dev.X[0], dev.Y[0], trace_id)
+        # keep the newest samples if nobody is reading them
+        while True:
+            try:
+                self.touch_queue.put_nowait(sample)
+                metrics.TOUCH_SAMPLES.labels('queued').inc()
+                return
+            except queue.Full:
+                try:
+                    self.touch_queue.get_nowait()
+                    metrics.TOUCH_SAMPLES.labels('dropped').inc()
+                except queue.Empty:
+                    pass
+
+    def start_display(self):
+        # runs first on the display thread, so constructing the interface
+        # and starting the API don't wait for the panel and touch resets
+        self.display.init(self.display.FULL_UPDATE)
+        self.touch_interface.GT_Init()
+        self.touch_interface.set_int_callback(self.on_touch_interrupt)
+        # a frame sent during bring-up is the base image instead of a blank one
+        with self.render_condition:
+            frame = self.swap_frame()
+        if frame is not None and frame.buffer is not None:
+            buffer = frame.buffer
+        else:
+            buffer = self.display.getbuffer(self.canvas)
+        self.display_base_image(buffer)
+        if frame is not None:
+            self.rendered_frames += 1
+        self.ready.set()
 
     def display_loop(self):
-        while self.display_thread_flag:
-            now = time.time()
-            if self.should_render:
-                self.render()
-            elif self.screen_is_active and (now - self.last_touched > self.TIMEOUT_INTERVAL):
-                self.sleep()
-            elif not self.screen_is_active and (now - self.last_touched < self.TIMEOUT_INTERVAL):
-                self.awaken()
-            elif now - self.last_full_refresh > self.MAX_REFRESH_INTERVAL:
-                self.clear_screen()
-            time.sleep(EPaperInterface.MIN_REFRESH_INTERVAL)
+        try:
+            self.start_display()
+        except Exception as e:
+            self.startup_error = str(e)
+            print("Couldn't start the display. Exception was:" + str(e))
+            self.stop_display()
+            return
+
+        try:
+            while self.display_thread_flag:
+                with self.render_condition:
+                    # wake as soon as a frame, command or touch arrives, otherwise
+                    # once per interval for the housekeeping below. Frames sent
+                    # while the panel sleeps wait for it to wake up.
+                    self.render_condition.wait_for(
+                        lambda: (self.back_frame is not None and self.screen_is_active) or self.commands or
+                        (self.wake_requested and not self.screen_is_active) or
+                        not self.display_thread_flag,
+                        timeout=EPaperInterface.MIN_REFRESH_INTERVAL)
+                    commands = list(self.commands)
+                    self.commands.clear()
+                    frame = self.swap_frame() if self.screen_is_active else None
+                if not self.display_thread_flag:
+                    for future, _, _ in commands:
+                        future.set_exception(RuntimeError("The display thread has stopped"))
+                    break
+
+                for future, command, args in commands:
+                    self.run_command(future, command, args)
+
+                # one bad frame or refresh mustn't stop the thread, the next
+                # frame may well be fine
+                try:
+                    self.display_step(frame)
+                except Exception as e:
+                    if frame is not None:
+                        metrics.FRAMES.labels('failed').inc()
+                    print("The display thread failed to update the panel. Exception was:" + str(e))
+        finally:
+            # anything that escapes the loop ends the thread, fail what waits on it
+            self.stop_display()
+
+    def display_step(self, frame):
+        now = time.time()
+        if not self.screen_is_active and (self.wake_requested or now - self.last_touched < self.TIMEOUT_INTERVAL):
+            self.awaken()
+        elif frame is not None:
+            with metrics.RENDER_SECONDS.time(), tracing.context(frame.trace_id), \
+                    tracing.span('render'):
+                self.render(frame)
+        elif self.screen_is_active and (now - self.last_touched > self.TIMEOUT_INTERVAL):
+            self.sleep()
+        elif self.screen_is_active and self.ghosting_pixels >= self.GHOSTING_BUDGET and self.full_refresh_allowed(now):
+            self.full_refresh()
+        elif self.screen_is_active and self.ghosting_pixels > 0 and \
+                now - self.last_full_refresh > self.MAX_REFRESH_INTERVAL:
+            self.full_refresh()
+
+    def stop_display(self):
+        # runs on the display thread when it exits, submit refuses new commands
+        with self.render_condition:
+            self.display_thread_flag = False
+            commands = list(self.commands)
+            self.commands.clear()
+        for future, _, _ in commands:
+            future.set_exception(RuntimeError("The display thread has stopped"))
+
+    def submit(self, command, *args):
+        # queue a call for the display thread, which owns the panel, and
+        # return a concurrent.futures.Future for its result
+        future = Future()
+        with self.render_condition:
+            if not self.display_thread_flag:
+                future.set_exception(RuntimeError("The display thread has stopped"))
+                return future
+            self.commands.append((future, command, args))
+            self.render_condition.notify()
+        return future
+
+    def run_command(self, future, command, args):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(command(*args))
+        except Exception as e:
+            future.set_exception(e)
+
+    def swap_frame(self):
+        # callers must hold render_condition
+        frame, self.back_frame = self.back_frame, None
+        if frame is None:
+            return None
+        if frame.buffer is None:
+            self.canvas = frame.canvas
+        else:
+            self._canvas = None
+            self.canvas_buffer = frame.buffer
+        return frame
+
+    @property
+    def canvas(self):
+        # pre-packed frames only get unpacked into a canvas when asked for
+        if self._canvas is None and self.canvas_buffer is not None:
+            self._canvas = self.display.packer.unpack(self.canvas_buffer)
+        return self._canvas
+
+    @canvas.setter
+    def canvas(self, canvas):
+        self._canvas = canvas
+        self.canvas_buffer = None
+
+    def touch_event_loop(self):
+        # turns queued touch samples into gesture state and publishes it
+        while self.touch_flag:
+            try:
+                touch_count, x, y, trace_id = self.touch_queue.get(
+                    timeout=EPaperInterface.MIN_REFRESH_INTERVAL)
+            except queue.Empty:
+                continue
+            with tracing.span('touch.dispatch', trace_id):
+                self.did_swipe = False
+                self.did_tap = False
+                self.process_touch_sample(touch_count, x, y)
+                screen_data = self.screen_state()
+                self.remember_gesture(screen_data)
+                if trace_id is not None:
+                    # clients pass it back with the frame they draw in response
+                    screen_data["trace_id"] = trace_id
+                # subscribers of an app only get events while its surface
+                # is on the panel
+                screen_data["app"] = self.surfaces.showing
+                for listener in list(self.touch_listeners):
+                    try:
+                        listener(screen_data)
+                    except Exception as e:
+                        print("A touch listener failed. Exception was:" + str(e))
+
+    def add_touch_listener(self, listener):
+        self.touch_listeners.append(listener)
+
+    def remove_touch_listener(self, listener):
+        if listener in self.touch_listeners:
+            self.touch_listeners.remove(listener)
+
+    def remember_gesture(self, screen_data):
+        # kept until the next poll, later samples reset did_tap and did_swipe
+        with self.unread_gestures_lock:
+            if screen_data["did_tap"]:
+                self.unread_gestures.update(
+                    did_tap=True, tap_x=screen_data["tap_x"], tap_y=screen_data["tap_y"])
+            if screen_data["did_swipe"]:
+                self.unread_gestures.update(
+                    did_swipe=True, swipe_direction=screen_data["swipe_direction"])
 
     def detect_screen_interaction(self):
+        # latest state published by touch_event_loop, each tap and swipe is
+        # only reported by the first poll after it
+        with self.unread_gestures_lock:
+            screen_data = self.screen_state()
+            screen_data["did_tap"] = False
+            screen_data["did_swipe"] = False
+            screen_data.update(self.unread_gestures)
+            self.unread_gestures = {}
+        return screen_data
+
+    def process_touch_sample(self, touch_count, x, y):
         # y values go up as touch moves left
         # x values go up as touch moves down
-
-        self.did_swipe = False
-        self.did_tap = False
-
-        self.touch_interface.GT_Scan(
-            self.touch_interface_dev, self.touch_interface_old)
-        self.is_touching = self.touch_interface_dev.TouchCount > 0
+        self.is_touching = touch_count > 0
 
         if self.is_touching and not self.has_been_touching:
             self.last_touched = time.time()
-            self.touch_start_x = self.touch_interface_dev.X[0]
-            self.touch_start_y = self.touch_interface_dev.Y[0]
+            self.touch_start_x = x
+            self.touch_start_y = y
+
+        if self.is_touching:
+            self.touch_last_x = x
+            self.touch_last_y = y
 
         if self.has_been_touching and not self.is_touching:
-            self.touch_end_x = self.touch_interface_old.X[0]
-            self.touch_end_y = self.touch_interface_old.Y[0]
+            self.touch_end_x = self.touch_last_x
+            self.touch_end_y = self.touch_last_y
             distance_horizontal = self.touch_start_y - self.touch_end_y
-            self.did_swipe = abs(distance_horizontal) > 0
 
-            if self.did_swipe:
+            if abs(distance_horizontal) > 0:
+                self.did_swipe = True
                 self.swipe_direction = EPaperInterface.SWIPE_RIGHT if distance_horizontal > 0 else EPaperInterface.SWIPE_LEFT
             else:
                 self.did_tap = True
@@ -131,6 +387,7 @@ class EPaperInterface():
 
         self.has_been_touching = self.is_touching
 
+    def screen_state(self):
         return {"last_touched": self.last_touched,
                 "is_touching": self.is_touching,
                 "has_been_touching": self.has_been_touching,
@@ -146,54 +403,284 @@ class EPaperInterface():
 
     def shutdown(self):
         self.touch_flag = False
-        self.display_thread_flag = False
+        self.touch_interface.set_int_callback(None)
+        with self.render_condition:
+            self.display_thread_flag = False
+            self.render_condition.notify_all()
+        # let an in-flight refresh finish before powering the panel down
+        if threading.current_thread() is not self.display_thread:
+            self.display_thread.join()
         self.screen_is_active = False
         self.app_is_running = False
-        self.sleep()
+        self.sleep(clear=True)
         self.display.Dev_exit()
-        self.base_touch_thread.join()
-        self.display_thread.join()
+        self.save_glyph_atlases()
 
-    def sleep(self):
+    def save_glyph_atlases(self):
+        # lines drawn since the last save, for the next start
+        for atlas in (self._glyph_atlases or {}).values():
+            if atlas.changed:
+                atlas.save()
+
+    def sleep(self, clear=None):
         self.screen_is_active = False
-        self.clear_screen()
-        time.sleep(2)
-        self.display.sleep()
+        if clear is None:
+            clear = EPaperInterface.CLEAR_ON_SLEEP
+        if clear:
+            self.clear_screen()
+            self.display.sleep()
+        else:
+            # nothing is powered down, so no need to wait after the command
+            self.display.sleep(delay_ms=0)
 
     def awaken(self):
-        self.screen_is_active = True
-        self.display.init(self.display.PART_UPDATE)
-        self.display.displayPartBaseImage(self.display.getbuffer(self.canvas))
+        # the touch counts as activity, or the panel would go right back to sleep
+        self.last_touched = max(self.last_touched, time.time())
+        if self.last_buffer is None:
+            # the panel was cleared, draw the frame again with a full refresh
+            self.full_refresh(self.display.getbuffer(self.canvas))
+        else:
+            # the panel still shows the last frame, only its RAM needs it back
+            self.display.init(self.display.PART_UPDATE)
+            self.display.WriteBaseImage(self.last_buffer)
+        with self.render_condition:
+            self.screen_is_active = True
+            self.wake_requested = False
 
     def clear_screen(self):
         self.display.init(self.display.FULL_UPDATE)
         self.display.Clear(0xFF)
+        # RAM no longer matches the last frame, next render pushes a full window
+        self.last_buffer = None
+        self.last_buffer_digest = None
+
+    def display_base_image(self, buffer):
+        self.display.displayPartBaseImage(buffer)
+        self.last_buffer = bytes(buffer)
+        self.last_buffer_digest = framebuffer.digest(self.last_buffer)
 
     def reset_canvas(self):
-        self.canvas = Image.new('1', (self.height, self.width), 255)
-        self.canvas.rotate(90)  # landscape mode
+        # landscape mode, getbuffer maps it onto the portrait panel rows
+        canvas = Image.new('1', (self.height, self.width), 255)
+        with self.render_condition:
+            self.canvas = canvas
 
-    def render(self):
-        self.should_render = False
+    def render(self, frame=None):
         if not self.screen_is_active:
             return
-        if self.partial_refresh_counter >= EPaperInterface.MAX_PARTIAL_REFRESHES:
-            self.display.init(self.display.FULL_UPDATE)
-            self.display.displayPartBaseImage(
-                self.display.getbuffer(self.canvas))
-            self.partial_refresh_counter = 0
+        # packing and diffing overlap with the previous partial refresh,
+        # the driver only waits for BUSY once it needs the panel again
+        if frame is not None and frame.buffer is not None:
+            buffer = frame.buffer
         else:
-            self.display.displayPartial(self.display.getbuffer(self.canvas))
+            buffer = self.display.getbuffer(self.canvas)
+
+        # identical frames are common with clients that re-upload on a timer
+        digest = framebuffer.digest(buffer)
+        if digest == self.last_buffer_digest:
+            self.skipped_frames += 1
+            metrics.FRAMES.labels('skipped').inc()
+            return
+        self.rendered_frames += 1
+
+        changed = framebuffer.changed_pixels(self.last_buffer, buffer)
+        if self.ghosting_pixels + changed >= EPaperInterface.GHOSTING_BUDGET and \
+                self.full_refresh_allowed(time.time()):
+            metrics.FRAMES.labels('full').inc()
+            self.full_refresh(buffer)
+        else:
+            # only push the band of rows and byte columns that changed
+            window = framebuffer.changed_window(
+                self.last_buffer, buffer, self.width, self.height)
+            if window is None:
+                return
+            self.display.displayPartialWindow(
+                buffer, *window, profile=frame.profile if frame is not None else None)
+            metrics.FRAMES.labels('partial').inc()
+            self.last_buffer = bytes(buffer)
+            self.last_buffer_digest = digest
             self.partial_refresh_counter += 1
+            self.ghosting_pixels += changed
 
-    def request_render(self, image_data=None):
-        self.canvas = Image.open(io.BytesIO(image_data))
-        self.should_render = True
+    def full_refresh(self, buffer=None):
+        # redraw what is on the panel, or buffer, with the slow clean waveform
+        if buffer is None:
+            buffer = self.last_buffer or self.display.getbuffer(self.canvas)
+        self.display.init(self.display.FULL_UPDATE)
+        self.display_base_image(buffer)
+        self.partial_refresh_counter = 0
+        self.ghosting_pixels = 0
+        self.last_full_refresh = time.time()
+
+    def full_refresh_allowed(self, now):
+        # a due full refresh waits until nobody has touched the screen for a bit
+        if not EPaperInterface.DEFER_FULL_REFRESH:
+            return True
+        return not self.is_touching and now - self.last_touched > EPaperInterface.IDLE_INTERVAL
+
+    def request_render(self, image_data=None, profile=None, trace_id=None, app=None):
+        self.display.GetRefreshProfile(profile)
+        # decode on the caller's thread so the display thread only packs
+        with tracing.span('decode', trace_id):
+            canvas = self.open_image(image_data)
+        self.present(Frame(canvas=canvas, profile=profile, trace_id=trace_id), app)
+
+    def request_render_image(self, image, profile=None, trace_id=None, app=None):
+        self.display.GetRefreshProfile(profile)
+        self.present(Frame(canvas=image, profile=profile, trace_id=trace_id), app)
+
+    def open_image(self, image_data):
+        # accepts encoded image bytes or an already prepared PIL image
+        if isinstance(image_data, Image.Image):
+            return image_data
+        with metrics.DECODE_SECONDS.time():
+            image = Image.open(io.BytesIO(image_data))
+            image.load()
+        return image
+
+    def request_render_buffer(self, buffer, profile=None, trace_id=None, app=None):
+        self.display.GetRefreshProfile(profile)
+        # buffer is already in the panel's packed layout, as from getbuffer
+        expected = framebuffer.linewidth(self.width) * self.height
+        if len(buffer) != expected:
+            raise ValueError("Packed frame must be " + str(expected) +
+                             " bytes, got " + str(len(buffer)))
+        self.present(Frame(buffer=buffer, profile=profile, trace_id=trace_id), app)
+
+    def draw(self, commands, profile=None, trace_id=None, app=None):
+        # applies a batch of drawing commands to the newest canvas, or the
+        # app's surface, as one frame
+        self.display.GetRefreshProfile(profile)
+        with self.draw_lock, tracing.span('draw', trace_id):
+            canvas = self.latest_canvas() if app is None else self.surfaces.canvas(app)
+            if not self.display.packer.supports(canvas.size):
+                raise ValueError("The current canvas can't be drawn on, reset it first")
+            canvas = canvas.convert('1') if canvas.mode != '1' else canvas.copy()
+            drawing.apply_commands(canvas, commands, self.glyph_atlases)
+            self.present(Frame(canvas=canvas, profile=profile, trace_id=trace_id), app)
+
+    def latest_canvas(self):
+        # the pending frame if there is one, otherwise what is on the panel
+        with self.render_condition:
+            frame = self.back_frame
+            if frame is None:
+                return self.canvas
+        if frame.buffer is not None:
+            return self.display.packer.unpack(frame.buffer)
+        return frame.canvas
+
+    def update_layer(self, name, image_data, z=0, opaque_box=None, profile=None):
+        self.display.GetRefreshProfile(profile)
+        self.compositor.set_layer(name, self.open_image(image_data), z, opaque_box)
+        self.render_layers(profile)
+
+    def draw_layer(self, name, commands, z=None, opaque_box=None, profile=None):
+        self.display.GetRefreshProfile(profile)
+        self.compositor.draw_layer(name, commands, self.glyph_atlases, z, opaque_box)
+        self.render_layers(profile)
+
+    def remove_layer(self, name, profile=None):
+        self.display.GetRefreshProfile(profile)
+        if not self.compositor.remove_layer(name):
+            raise ValueError("No layer named " + str(name))
+        self.render_layers(profile)
+
+    def render_layers(self, profile=None):
+        self.request_render_buffer(self.compositor.compose(), profile)
+
+    def preload_screen(self, name, image_data):
+        image = self.open_image(image_data)
+        if not self.display.packer.supports(image.size):
+            raise ValueError("Screen must be " + str(self.height) + "x" + str(self.width) +
+                             " or " + str(self.width) + "x" + str(self.height))
+        self.screens.pack(name, image)
+
+    def display_screen(self, name, profile=None, app=None):
+        buffer = self.screens.get(name)
+        if buffer is None:
+            raise ValueError("No preloaded screen named " + str(name))
+        self.request_render_buffer(buffer, profile, app=app)
+
+    def present(self, frame, app=None):
+        # frames without an app go straight to the panel and take it from
+        # the focused app. An app's frame is kept as its surface and only
+        # shown while the app has focus
+        if frame.canvas is not None and not self.display.packer.supports(frame.canvas.size):
+            raise ValueError("Frame must be " + str(self.height) + "x" + str(self.width) +
+                             " or " + str(self.width) + "x" + str(self.height))
+        if app is None:
+            with self.render_condition:
+                self.surfaces.release()
+                self.queue_frame(frame)
+            return
+        if frame.buffer is None:
+            # surfaces are retained packed, pack here rather than on the display thread
+            frame.buffer = self.surfaces.packer.pack_bytes(frame.canvas)
+            frame.canvas = None
+        # under render_condition so a focus change can't slip in between
+        with self.render_condition:
+            if self.surfaces.update(app, frame.buffer):
+                self.queue_frame(frame)
+
+    def focus_app(self, app, profile=None):
+        # shows the app's retained surface with a partial refresh
+        self.display.GetRefreshProfile(profile)
+        with self.render_condition:
+            self.queue_frame(Frame(buffer=self.surfaces.focus(app), profile=profile))
+
+    def remove_app(self, app, profile=None):
+        '''
+        Drops the app's surface. If the surface was on the panel, the app
+        below it takes over and its surface is shown. Removing the last app
+        queues a blank frame, the panel doesn't keep showing an app that is
+        gone.
+        '''
+        self.display.GetRefreshProfile(profile)
+        with self.render_condition:
+            buffer = self.surfaces.remove(app)
+            if buffer is not None:
+                self.queue_frame(Frame(buffer=buffer, profile=profile))
+
+    def queue_frame(self, frame):
+        with self.render_condition:
+            # latest frame wins if the panel hasn't picked up the previous one
+            if self.back_frame is not None:
+                self.coalesced_frames += 1
+                metrics.FRAMES.labels('coalesced').inc()
+                tracing.instant('frame.coalesced', self.back_frame.trace_id)
+            tracing.instant('frame.queued', frame.trace_id)
+            self.back_frame = frame
+            self.render_condition.notify()
+
+    def export_metrics(self):
+        # every stage's counters and histograms in the Prometheus text format
+        return metrics.expose()
+
+    def render_stats(self):
+        return {"rendered_frames": self.rendered_frames,
+                "skipped_frames": self.skipped_frames,
+                "coalesced_frames": self.coalesced_frames,
+                "partial_refresh_counter": self.partial_refresh_counter,
+                "ghosting_pixels": self.ghosting_pixels,
+                "screen_cache": self.screens.stats(),
+                "layers": self.compositor.stats(),
+                "surfaces": self.surfaces.stats()}
 
     def get_window(self):
         return WindowData(width=self.width, height=self.height)
 
 
+class Frame:
+    # a frame waiting for the display thread, either a canvas to pack or
+    # a buffer that is already in the panel's layout, the name of the
+    # refresh profile to show it with and the trace of the touch it answers
+    def __init__(self, canvas=None, buffer=None, profile=None, trace_id=None):
+        self.canvas = canvas
+        self.buffer = buffer
+        self.profile = profile
+        self.trace_id = trace_id
+
+
 class WindowData:
     def __init__(self, width=None, height=None):
         self.width = width
@@ -1,33 +1,101 @@
+import asyncio
 from typing import Annotated
-from fastapi import FastAPI, UploadFile, WebSocket
+from fastapi import FastAPI, Query, Request, UploadFile, WebSocket
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 from EPaper import *
+from broker import TouchEventBroker
+from worker import HardwareWorker
+from preprocess import Preprocessor
+from lib import tracing
 
 interface = EPaperInterface()
+hardware = HardwareWorker(interface)
+preprocessor = Preprocessor((interface.height, interface.width))
+touch_events = TouchEventBroker()
 app = FastAPI()
 
+# the app a frame or subscription belongs to, see surfaces.py
+AppName = Annotated[str, Query(alias="app")]
+
+
+@app.on_event("startup")
+async def start_touch_events():
+    touch_events.attach(asyncio.get_running_loop())
+    interface.add_touch_listener(touch_events.publish)
+
+
+@app.on_event("shutdown")
+async def stop_touch_events():
+    interface.remove_touch_listener(touch_events.publish)
+    preprocessor.shutdown()
+    interface.save_glyph_atlases()
+
 
 @app.get("/")
 async def read_root():
     return {"Hello": "World"}
 
 
+@app.get("/health")
+async def health():
+    # the API serves requests while the panel is still starting, frames
+    # sent meanwhile are shown once it is up
+    health = interface.health()
+    return JSONResponse({"success": True, **health},
+                        status_code=200 if health["ready"] else 503)
+
+
 @app.websocket("/screen_interaction")
 async def screen_interaction_stream(
     websocket: WebSocket
 ):
     await websocket.accept()
-    while True:
-        signal = await websocket.receive_text()
-        if signal:
-            screen_data = interface.detect_screen_interaction()
-            await websocket.send_json(screen_data)
+    client_app = websocket.query_params.get("app")
+    events = touch_events.subscribe(client_app)
+    profile = websocket.query_params.get("profile")
+    # frames sent back without a trace id answer the last event pushed
+    last_trace = None
+
+    async def push_events():
+        nonlocal last_trace
+        try:
+            while True:
+                event = await events.get()
+                with tracing.span("websocket.send", event.get("trace_id")):
+                    await websocket.send_json(event)
+                last_trace = event.get("trace_id")
+        except Exception as e:
+            # the receive loop below ends once the client acknowledges
+            print("Couldn't push a touch event, closing the websocket. Exception was:" + str(e))
+            try:
+                await websocket.close(code=1011)
+            except Exception:
+                pass
+
+    pusher = asyncio.create_task(push_events())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            # binary messages are packed frames, as for /request_render_buffer
+            if message.get("bytes") is not None:
+                try:
+                    await hardware.request_render_buffer(
+                        message["bytes"], profile, last_trace, client_app)
+                except Exception as e:
+                    await websocket.send_json({"success": False, "error": str(e)})
+    finally:
+        pusher.cancel()
+        await asyncio.gather(pusher, return_exceptions=True)
+        touch_events.unsubscribe(events)
 
 
 @app.get("/screen_interaction")
 async def detect_screen_interaction():
     try:
-        screen_data = interface.detect_screen_interaction()
+        screen_data = await hardware.detect_screen_interaction()
         return {"success": True, "screen_data": screen_data}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -36,7 +104,7 @@ async def detect_screen_interaction():
 @app.post("/shutdown")
 async def shutdown():
     try:
-        interface.shutdown()
+        await hardware.shutdown()
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -45,7 +113,7 @@ async def shutdown():
 @app.post("/sleep")
 async def sleep():
     try:
-        interface.sleep()
+        await hardware.sleep()
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -54,7 +122,7 @@ async def sleep():
 @app.post("/awaken")
 async def awaken():
     try:
-        interface.awaken()
+        await hardware.awaken()
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -63,7 +131,7 @@ async def awaken():
 @app.post("/clear_screen")
 async def clear_screen():
     try:
-        interface.clear_screen()
+        await hardware.clear_screen()
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -72,22 +140,154 @@ async def clear_screen():
 @app.post("/reset_canvas")
 async def reset_canvas():
     try:
-        interface.reset_canvas()
+        await hardware.reset_canvas()
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 
 @app.post("/request_render")
-async def request_render(file: UploadFile):
+async def request_render(file: UploadFile, profile: str = None,
+                         fit: str = "contain", dither: str = "floyd-steinberg",
+                         trace_id: int = None, client_app: AppName = None):
+    try:
+        with tracing.span("preprocess", trace_id):
+            image = await preprocessor.process(await file.read(), fit, dither)
+        await hardware.request_render_image(image, profile, trace_id, client_app)
+        return {"success": True}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+@app.post("/request_render_buffer")
+async def request_render_buffer(request: Request, profile: str = None, trace_id: int = None,
+                                client_app: AppName = None):
+    try:
+        buffer = await request.body()
+        await hardware.request_render_buffer(buffer, profile, trace_id, client_app)
+        return {"success": True}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+@app.post("/draw")
+async def draw(request: Request):
+    try:
+        body = await request.json()
+        await hardware.draw(body["commands"], body.get("profile"), body.get("trace_id"),
+                            body.get("app"))
+        return {"success": True}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+@app.post("/update_layer")
+async def update_layer(name: str, file: UploadFile, z: int = 0,
+                       opaque_box: str = None, profile: str = None,
+                       fit: str = "contain", dither: str = "floyd-steinberg"):
+    try:
+        image = await preprocessor.process(await file.read(), fit, dither)
+        box = [int(v) for v in opaque_box.split(",")] if opaque_box else None
+        await hardware.update_layer(name, image, z, box, profile)
+        return {"success": True}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+@app.post("/draw_layer")
+async def draw_layer(request: Request):
+    try:
+        body = await request.json()
+        await hardware.draw_layer(body["name"], body["commands"], body.get("z"),
+                                  body.get("opaque_box"), body.get("profile"))
+        return {"success": True}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+@app.post("/remove_layer")
+async def remove_layer(name: str, profile: str = None):
     try:
-        image = await file.read()
-        interface.request_render(image_data=image)
+        await hardware.remove_layer(name, profile)
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 
+@app.post("/preload_screen")
+async def preload_screen(name: str, file: UploadFile,
+                         fit: str = "contain", dither: str = "floyd-steinberg"):
+    try:
+        image = await preprocessor.process(await file.read(), fit, dither)
+        await hardware.preload_screen(name, image)
+        return {"success": True}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+@app.post("/display_screen")
+async def display_screen(name: str, profile: str = None, client_app: AppName = None):
+    try:
+        await hardware.display_screen(name, profile, client_app)
+        return {"success": True}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+@app.post("/focus_app")
+async def focus_app(client_app: AppName, profile: str = None):
+    try:
+        await hardware.focus_app(client_app, profile)
+        return {"success": True}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+@app.post("/remove_app")
+async def remove_app(client_app: AppName, profile: str = None):
+    try:
+        await hardware.remove_app(client_app, profile)
+        return {"success": True}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+@app.get("/render_stats")
+async def render_stats():
+    try:
+        return {"success": True, "render_stats": interface.render_stats()}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def export_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(interface.export_metrics(),
+                             media_type="text/plain; version=0.0.4")
+
+
+@app.post("/trace/start")
+async def start_trace(capacity: int = tracing.CAPACITY):
+    try:
+        tracing.start(capacity)
+        return {"success": True, "trace": tracing.stats()}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+@app.post("/trace/stop")
+async def stop_trace():
+    tracing.stop()
+    return {"success": True, "trace": tracing.stats()}
+
+
+@app.get("/trace")
+async def export_trace():
+    # Chrome trace JSON, open it in chrome://tracing or ui.perfetto.dev
+    return tracing.export()
+
+
 @app.get("/window")
 async def get_window():
     try:
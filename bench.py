@@ -0,0 +1,334 @@
+'''
+Microbenchmarks for the display and touch hot paths, run against the
+emulated panel (see lib/emulator.py) with every modelled wait disabled.
+
+    python bench.py                            # run and print
+    python bench.py --record bench_baseline.json
+    python bench.py --compare bench_baseline.json --threshold 0.25
+
+Besides timings, each benchmark reports the SPI bytes and calls, and I2C
+reads, one operation issues. Those are deterministic, so any increase is
+a regression; timings only count as one when the median is slower than
+the baseline by more than the threshold. Each benchmark is measured
+--repeats times and the run with the lowest median is kept, a single
+median is too noisy for the threshold. With --compare, a benchmark that
+looks slower is run again up to --retries times before it is flagged,
+and --compare exits with status 1 on a regression.
+'''
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+os.environ['EPD_BACKEND'] = 'emulator'
+os.environ.setdefault('EPD_EMULATOR_TIME_SCALE', '0')
+
+from PIL import Image, ImageDraw
+
+from lib import epdconfig
+from lib import emulator
+from lib import epd2in13_V4
+from lib import framebuffer
+from lib import gt1151
+
+
+ITERATIONS = 200
+WARMUP = 5
+REPEATS = 3
+RETRIES = 2
+# seconds before a retry, lets a busy stretch on the machine pass
+RETRY_DELAY = 5
+THRESHOLD = 0.25
+# emulator counters reported per operation
+COUNTERS = ('spi_bytes', 'spi_calls', 'i2c_reads')
+
+BENCHMARKS = {}
+
+
+def benchmark(name, iterations=None):
+    # registers a setup function returning the operation to time
+    def register(setup):
+        BENCHMARKS[name] = (setup, iterations)
+        return setup
+    return register
+
+
+def sample_canvas(size=(250, 122), offset=0):
+    canvas = Image.new('1', size, 255)
+    draw = ImageDraw.Draw(canvas)
+    draw.rectangle((10 + offset, 10, 60 + offset, 60), fill=0)
+    draw.line((0, size[1] - 1, size[0] - 1, 0), fill=0, width=3)
+    draw.text((80 + offset, 40), "12:30", fill=0)
+    return canvas
+
+
+class Context:
+    # shared objects, the API and interface are only started when needed
+    def __init__(self):
+        self.epd = epd2in13_V4.EPD()
+        self.epd.init(self.epd.FULL_UPDATE)
+        self.touch = gt1151.GT1151()
+        self.client = None
+        self.app = None
+
+    def api(self):
+        if self.client is None:
+            from fastapi.testclient import TestClient
+            import app
+            self.app = app
+            self.client = TestClient(app.app)
+            self.client.__enter__()
+            app.interface.ready.wait()
+        return self.client
+
+    def close(self):
+        if self.client is not None:
+            self.client.__exit__(None, None, None)
+            self.app.interface.shutdown()
+
+
+@benchmark('getbuffer_landscape')
+def bench_getbuffer_landscape(context):
+    canvas = sample_canvas()
+    return lambda: context.epd.getbuffer(canvas)
+
+
+@benchmark('getbuffer_portrait')
+def bench_getbuffer_portrait(context):
+    canvas = sample_canvas((122, 250))
+    return lambda: context.epd.getbuffer(canvas)
+
+
+@benchmark('display_partial')
+def bench_display_partial(context):
+    buffer = bytes(context.epd.getbuffer(sample_canvas()))
+    context.epd.init(context.epd.PART_UPDATE)
+    return lambda: context.epd.displayPartial(buffer)
+
+
+@benchmark('display_partial_window')
+def bench_display_partial_window(context):
+    # a small change, the way EPaperInterface.render sends it
+    old = bytes(context.epd.getbuffer(sample_canvas()))
+    new = bytes(context.epd.getbuffer(sample_canvas(offset=4)))
+    window = framebuffer.changed_window(old, new, context.epd.width, context.epd.height)
+    context.epd.init(context.epd.PART_UPDATE)
+    return lambda: context.epd.displayPartialWindow(new, *window)
+
+
+@benchmark('display_base_image', iterations=50)
+def bench_display_base_image(context):
+    buffer = bytes(context.epd.getbuffer(sample_canvas()))
+    return lambda: context.epd.displayPartBaseImage(buffer)
+
+
+@benchmark('clear', iterations=50)
+def bench_clear(context):
+    return lambda: context.epd.Clear(0xFF)
+
+
+@benchmark('gt_scan')
+def bench_gt_scan(context):
+    dev = gt1151.GT_Development()
+    old = gt1151.GT_Development()
+    epdconfig.inject_touch([(60, 120), (80, 40)])
+
+    def scan():
+        # GT_Scan acknowledges the report, mark it ready again
+        epdconfig.implementation.touch_registers[emulator.GT1151_STATUS] = 0x82
+        dev.Touch = 1
+        context.touch.GT_Scan(dev, old)
+    return scan
+
+
+@benchmark('detect_screen_interaction')
+def bench_detect_screen_interaction(context):
+    context.api()
+    return context.app.interface.detect_screen_interaction
+
+
+@benchmark('request_render_buffer', iterations=100)
+def bench_request_render_buffer(context):
+    # HTTP round trip plus the display thread showing the frame
+    client = context.api()
+    interface = context.app.interface
+    buffers = [bytes(interface.display.getbuffer(sample_canvas(offset=offset)))
+               for offset in (0, 4)]
+    state = {'index': 0}
+
+    def render():
+        state['index'] ^= 1
+        shown = frames_shown(interface)
+        # however many frames came before, measure partial refreshes only
+        interface.ghosting_pixels = 0
+        response = client.post('/request_render_buffer', content=buffers[state['index']])
+        if not response.json()['success']:
+            raise RuntimeError(response.json()['error'])
+        wait_until(lambda: frames_shown(interface) != shown)
+    return render
+
+
+@benchmark('request_render_png', iterations=100)
+def bench_request_render_png(context):
+    # upload through the preprocessor, repeated images come from its cache
+    client = context.api()
+    interface = context.app.interface
+    images = []
+    for offset in (0, 4):
+        data = io.BytesIO()
+        sample_canvas(offset=offset).save(data, format='PNG')
+        images.append(data.getvalue())
+    state = {'index': 0}
+
+    def render():
+        state['index'] ^= 1
+        shown = frames_shown(interface)
+        # however many frames came before, measure partial refreshes only
+        interface.ghosting_pixels = 0
+        response = client.post('/request_render',
+                               files={'file': ('frame.png', images[state['index']], 'image/png')})
+        if not response.json()['success']:
+            raise RuntimeError(response.json()['error'])
+        wait_until(lambda: frames_shown(interface) != shown)
+    return render
+
+
+def frames_shown(interface):
+    # frames the display thread has finished with, identical ones are skipped.
+    # Refreshes are counted at the activate command, after the frame's SPI
+    # traffic, so none of it spills into the next measurement
+    return sum(epdconfig.stats()['refreshes'].values()) + interface.skipped_frames
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            raise RuntimeError("Timed out waiting for the display thread")
+        time.sleep(0.0001)
+
+
+def run(name, context, iterations=None, repeats=REPEATS):
+    setup, default_iterations = BENCHMARKS[name]
+    iterations = iterations or default_iterations or ITERATIONS
+    operation = setup(context)
+    for _ in range(WARMUP):
+        operation()
+    best = None
+    for _ in range(repeats):
+        result = measure(operation, iterations)
+        if best is None or result['median_us'] < best['median_us']:
+            best = result
+    best['repeats'] = repeats
+    return best
+
+
+def measure(operation, iterations):
+    epdconfig.reset_stats()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        operation()
+        timings.append(time.perf_counter() - start)
+    counters = epdconfig.stats()['counters']
+    timings.sort()
+    result = {'iterations': iterations,
+              'median_us': statistics.median(timings) * 1e6,
+              'p95_us': timings[int(len(timings) * 0.95) - 1] * 1e6,
+              'ops_per_s': iterations / sum(timings)}
+    for counter in COUNTERS:
+        result[counter] = counters.get(counter, 0) / iterations
+    return result
+
+
+def slower(result, old, threshold):
+    return result['median_us'] > old['median_us'] * (1 + threshold)
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        if slower(result, old, threshold):
+            regressions.append('%s: median %.1fus, baseline %.1fus (+%.0f%%)' % (
+                name, result['median_us'], old['median_us'],
+                (result['median_us'] / old['median_us'] - 1) * 100))
+        for counter in COUNTERS:
+            if result[counter] > old.get(counter, 0):
+                regressions.append('%s: %s %.1f per op, baseline %.1f' % (
+                    name, counter, result[counter], old.get(counter, 0)))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Display and touch microbenchmarks")
+    parser.add_argument('names', nargs='*', help="benchmarks to run, all by default")
+    parser.add_argument('--iterations', type=int, help="override every benchmark's iterations")
+    parser.add_argument('--repeats', type=int, default=REPEATS,
+                        help="runs per benchmark, the best median is kept (default %(default)s)")
+    parser.add_argument('--record', metavar='PATH', help="save the results as a baseline")
+    parser.add_argument('--compare', metavar='PATH', help="flag regressions against a baseline")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help="allowed relative slowdown of the median (default %(default)s)")
+    parser.add_argument('--retries', type=int, default=RETRIES,
+                        help="reruns of a slower benchmark before it is flagged (default %(default)s)")
+    args = parser.parse_args()
+
+    names = args.names or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error("unknown benchmarks: " + ", ".join(unknown))
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    context = Context()
+    results = {}
+    try:
+        print('%-28s %12s %12s %12s %10s %10s' % (
+            'benchmark', 'median us', 'p95 us', 'ops/s', 'spi bytes', 'spi calls'))
+        for name in names:
+            result = run(name, context, args.iterations, args.repeats)
+            old = baseline.get(name)
+            for _ in range(args.retries):
+                if old is None or not slower(result, old, args.threshold):
+                    break
+                # a busy moment on the machine looks the same, confirm it first
+                time.sleep(RETRY_DELAY)
+                retry = run(name, context, args.iterations, args.repeats)
+                if retry['median_us'] < result['median_us']:
+                    result = retry
+            results[name] = result
+            print('%-28s %12.1f %12.1f %12.0f %10.0f %10.1f' % (
+                name, result['median_us'], result['p95_us'], result['ops_per_s'],
+                result['spi_bytes'], result['spi_calls']))
+    finally:
+        context.close()
+
+    if args.record:
+        with open(args.record, 'w') as f:
+            json.dump({'machine': {'platform': platform.platform(),
+                                   'python': platform.python_version(),
+                                   'processor': platform.machine()},
+                       'results': results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    if args.compare:
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+        print('No regressions against ' + args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+import asyncio
+
+
+class TouchEventBroker:
+    # Fans touch events published from the interface's touch thread out to
+    # one bounded asyncio queue per subscriber. Slow subscribers lose their
+    # oldest events instead of holding up everyone else.
+
+    QUEUE_SIZE = 32
+
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.loop = None
+        # queue to the app it subscribed for, None for every event
+        self.subscribers = {}
+
+    def attach(self, loop):
+        self.loop = loop
+
+    def publish(self, event):
+        # safe to call from any thread
+        if self.loop is None or self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.fan_out, event)
+
+    def fan_out(self, event):
+        for events, app in self.subscribers.items():
+            # an app's subscribers only see touches made while it has focus
+            if app is not None and event.get("app") != app:
+                continue
+            if events.full():
+                events.get_nowait()
+            events.put_nowait(event)
+
+    def subscribe(self, app=None):
+        events = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers[events] = app
+        return events
+
+    def unsubscribe(self, events):
+        self.subscribers.pop(events, None)
@@ -0,0 +1,105 @@
+import threading
+import numpy as np
+from PIL import Image, ImageDraw
+
+import drawing
+
+
+class Layer:
+    # A full-size landscape canvas and its packed copy. White pixels are
+    # transparent and black pixels cover the layers below, except inside
+    # opaque_box where the layer's white covers them too.
+    def __init__(self, name, z, canvas, opaque_box=None):
+        self.name = name
+        self.z = z
+        self.canvas = canvas
+        self.opaque_box = opaque_box
+        self.buffer = None
+        self.mask = None
+        self.dirty = True
+
+
+class Compositor:
+    # Stacks layers in z order in the packed domain: transparent layers are
+    # ANDed in (black wins) and opaque boxes are blended with their mask,
+    # (below & ~mask) | (layer & mask). Layers are only repacked when they
+    # changed, so updating a small overlay over a complex background costs
+    # one pack and a few vectorized bitwise operations.
+
+    def __init__(self, packer):
+        self.packer = packer
+        self.size = (packer.height, packer.width)
+        self.layers = {}
+        self.lock = threading.Lock()
+        self.background = self.pack(Image.new('1', self.size, 255))
+
+    def pack(self, canvas):
+        return np.frombuffer(self.packer.pack_bytes(canvas), dtype=np.uint8)
+
+    def blank_canvas(self):
+        return Image.new('1', self.size, 255)
+
+    def check_canvas(self, canvas):
+        if canvas.size != self.size:
+            raise ValueError("Layers must be " + str(self.size[0]) + "x" + str(self.size[1]))
+        return canvas if canvas.mode == '1' else canvas.convert('1')
+
+    def check_box(self, box):
+        if box is None:
+            return None
+        if len(box) != 4:
+            raise ValueError("opaque_box must be [x0, y0, x1, y1]")
+        return tuple(int(v) for v in box)
+
+    def set_layer(self, name, canvas, z=0, opaque_box=None):
+        canvas = self.check_canvas(canvas)
+        with self.lock:
+            self.layers[name] = Layer(name, z, canvas, self.check_box(opaque_box))
+
+    def draw_layer(self, name, commands, fonts, z=None, opaque_box=None):
+        # the batch is drawn on a copy so a bad command leaves the layer as it was
+        with self.lock:
+            layer = self.layers.get(name)
+            canvas = layer.canvas.copy() if layer is not None else self.blank_canvas()
+        drawing.apply_commands(canvas, commands, fonts)
+        with self.lock:
+            if layer is None or self.layers.get(name) is not layer:
+                self.layers[name] = Layer(name, z or 0, canvas, self.check_box(opaque_box))
+                return
+            layer.canvas = canvas
+            if z is not None:
+                layer.z = z
+            if opaque_box is not None:
+                layer.opaque_box = self.check_box(opaque_box)
+                layer.mask = None
+            layer.dirty = True
+
+    def remove_layer(self, name):
+        with self.lock:
+            return self.layers.pop(name, None) is not None
+
+    def compose(self):
+        with self.lock:
+            layers = sorted(self.layers.values(), key=lambda layer: layer.z)
+            out = self.background.copy()
+            for layer in layers:
+                if layer.dirty:
+                    layer.buffer = self.pack(layer.canvas)
+                    layer.dirty = False
+                if layer.opaque_box is None:
+                    np.bitwise_and(out, layer.buffer, out=out)
+                    continue
+                if layer.mask is None:
+                    mask = Image.new('1', self.size, 0)
+                    ImageDraw.Draw(mask).rectangle(layer.opaque_box, fill=255)
+                    layer.mask = self.pack(mask)
+                out &= ~layer.mask
+                out |= layer.buffer & layer.mask
+                # black pixels outside the box still draw over what is below
+                out &= layer.buffer | layer.mask
+            return out.tobytes()
+
+    def stats(self):
+        with self.lock:
+            return {name: {"z": layer.z, "opaque_box": layer.opaque_box}
+                    for name, layer in self.layers.items()}
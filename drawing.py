@@ -0,0 +1,85 @@
+import base64
+from PIL import Image, ImageDraw
+
+
+# Drawing commands applied to a 1-bit landscape canvas. Each command is a
+# dict with an "op" key, coordinates are canvas pixels and colours are
+# 0 / "black" or 1 / 255 / "white".
+#
+#   {"op": "text", "xy": [x, y], "text": "12:30", "font": 15, "fill": 0}
+#   {"op": "rect", "box": [x0, y0, x1, y1], "fill": 1, "outline": 0, "width": 1}
+#   {"op": "line", "xy": [x0, y0, x1, y1, ...], "fill": 0, "width": 1}
+#   {"op": "bitmap", "xy": [x, y], "size": [w, h], "data": "<base64>"}
+#   {"op": "fill", "box": [x0, y0, x1, y1], "fill": 1}
+#
+# bitmap data is a packed 1-bit image, rows padded to whole bytes, most
+# significant bit first, 1 for white, i.e. Image.tobytes() of a '1' image.
+
+
+def colour(value, default=0):
+    if value is None:
+        return default
+    if value in ("black", 0):
+        return 0
+    if value in ("white", 1, 255):
+        return 255
+    raise ValueError("Unknown colour " + str(value))
+
+
+def optional_colour(value):
+    return None if value is None else colour(value)
+
+
+def draw_text(canvas, draw, command, fonts):
+    size = command.get("font", 15)
+    if size not in fonts:
+        raise ValueError("Unknown font size " + str(size) +
+                         ", expected one of " + ", ".join(str(f) for f in fonts))
+    fonts[size].draw_text(canvas, tuple(command["xy"]), str(command["text"]),
+                          fill=colour(command.get("fill")))
+
+
+def draw_rect(canvas, draw, command, fonts):
+    draw.rectangle(command["box"], fill=optional_colour(command.get("fill")),
+                   outline=optional_colour(command.get("outline", 0)),
+                   width=command.get("width", 1))
+
+
+def draw_line(canvas, draw, command, fonts):
+    draw.line(command["xy"], fill=colour(command.get("fill")),
+              width=command.get("width", 1))
+
+
+def draw_bitmap(canvas, draw, command, fonts):
+    width, height = command["size"]
+    data = base64.b64decode(command["data"])
+    if len(data) != (width + 7) // 8 * height:
+        raise ValueError("Bitmap data doesn't match its size")
+    canvas.paste(Image.frombytes('1', (width, height), data), tuple(command["xy"]))
+
+
+def fill_region(canvas, draw, command, fonts):
+    canvas.paste(colour(command.get("fill"), 255), tuple(command["box"]))
+
+
+OPERATIONS = {
+    "text": draw_text,
+    "rect": draw_rect,
+    "line": draw_line,
+    "bitmap": draw_bitmap,
+    "fill": fill_region,
+}
+
+
+def apply_commands(canvas, commands, fonts):
+    # draws into canvas in place, callers wanting all-or-nothing batches
+    # should pass a copy. fonts maps sizes to glyphs.GlyphAtlas
+    draw = ImageDraw.Draw(canvas)
+    for command in commands:
+        operation = OPERATIONS.get(command.get("op"))
+        if operation is None:
+            raise ValueError("Unknown drawing operation " + str(command.get("op")))
+        try:
+            operation(canvas, draw, command, fonts)
+        except (KeyError, TypeError) as e:
+            raise ValueError("Invalid " + command["op"] + " command: " + str(e))
@@ -0,0 +1,124 @@
+import collections
+import os
+import pickle
+import threading
+import PIL
+from PIL import Image, ImageDraw, ImageFont
+
+
+cachedir = os.path.join(os.path.expanduser('~'), '.cache', 'epd-middleware')
+
+# ImageDraw.text's default spacing between lines
+LINE_SPACING = 4
+
+
+class LazyFont:
+    # A class attribute that loads its TrueType font on first access and
+    # then replaces itself with it, so importing a module stays cheap.
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner=None):
+        font = ImageFont.truetype(self.path, self.size)
+        setattr(owner, self.name, font)
+        return font
+
+
+class GlyphAtlas:
+    # Non-antialiased 1-bit bitmaps of the text lines drawn in one font, with
+    # their offsets, so repeated labels are pasted instead of going through
+    # FreeType for every frame. Lines are cached whole because FreeType's
+    # monochrome hinting places a glyph differently depending on its
+    # neighbours: glyph bitmaps laid out with getlength and kerning land a
+    # pixel off in pairs like 'Tj' and 'jg', only the line's own bitmap
+    # matches ImageDraw.text. The most recently used lines are pickled to
+    # cachedir, see EPaperInterface.save_glyph_atlases, and reused across
+    # restarts.
+
+    MAX_LINES = 512
+
+    def __init__(self, font, max_lines=MAX_LINES):
+        self.font = font
+        self.max_lines = max_lines
+        self.lock = threading.Lock()
+        self.lines = collections.OrderedDict()
+        self.changed = False
+        # the same step ImageDraw.text uses between the lines of multiline text
+        self.line_height = font.getbbox('A', '1')[3] + LINE_SPACING
+        self.path = self.cache_path()
+        self.load()
+
+    def cache_path(self):
+        # fonts not loaded from a file can't be keyed, so they aren't persisted
+        if not isinstance(getattr(self.font, 'path', None), str):
+            return None
+        # the file's size and mtime, so replacing the font invalidates it
+        try:
+            stat = os.stat(self.font.path)
+        except OSError:
+            return None
+        name = '%s-%d-%d-%s-%s.lines.pickle' % (
+            os.path.basename(self.font.path), stat.st_size, stat.st_mtime_ns,
+            self.font.size, PIL.__version__)
+        return os.path.join(cachedir, name)
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'rb') as f:
+                lines = pickle.load(f)
+        except Exception:
+            return False
+        for line, (size, data, offset) in lines:
+            self.lines[line] = (Image.frombytes('1', size, data), offset)
+        return True
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            lines = [(line, (bitmap.size, bitmap.tobytes(), offset))
+                     for line, (bitmap, offset) in self.lines.items()]
+            self.changed = False
+        try:
+            os.makedirs(cachedir, exist_ok=True)
+            with open(self.path, 'wb') as f:
+                pickle.dump(lines, f)
+        except OSError as e:
+            print("Couldn't save the glyph atlas. Exception was:" + str(e))
+
+    def line(self, text):
+        with self.lock:
+            line = self.lines.get(text)
+            if line is not None:
+                self.lines.move_to_end(text)
+                return line
+        line = self.rasterize(text)
+        with self.lock:
+            self.lines[text] = line
+            while len(self.lines) > self.max_lines:
+                self.lines.popitem(last=False)
+            self.changed = True
+        return line
+
+    def rasterize(self, text):
+        # the mask ImageDraw.text would paste, from a single FreeType layout
+        # and render, so a miss costs about as much as drawing the text
+        mask, offset = self.font.getmask2(text, '1')
+        bitmap = Image.new('1', (max(mask.size[0], 1), max(mask.size[1], 1)), 0)
+        ImageDraw.Draw(bitmap).draw.draw_bitmap((0, 0), mask, 255)
+        return (bitmap, offset)
+
+    def draw_text(self, canvas, xy, text, fill=0):
+        x, y = int(xy[0]), int(xy[1])
+        for text in text.split('\n'):
+            if text:
+                bitmap, (left, top) = self.line(text)
+                canvas.paste(fill, (x + left, y + top), bitmap)
+            y += self.line_height
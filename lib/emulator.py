@@ -0,0 +1,335 @@
+import collections
+import os
+import threading
+import time
+
+from . import epdconfig
+from . import framebuffer
+
+
+# Hardware-free backend for epdconfig, selected with EPD_BACKEND=emulator.
+# It interprets the SSD1680 command stream the EPD driver sends into RAM
+# and panel framebuffers, models BUSY for resets and refreshes, and serves
+# a GT1151 register map that tests fill through inject_touch.
+#
+# Durations are rough figures for the 2.13" V4 panel at room temperature.
+# EPD_EMULATOR_TIME_SCALE scales every modelled wait, 0 makes them
+# instantaneous for benchmarks and CI.
+
+TIME_SCALE = float(os.environ.get('EPD_EMULATOR_TIME_SCALE', '1'))
+
+WIDTH = 122
+HEIGHT = 250
+
+# display update control (0x22) to (kind, milliseconds)
+REFRESH_TIMINGS = {
+    0xF7: ('full', 2000),
+    0xC7: ('full', 1500),
+    0xFF: ('partial', 300),
+    0xDF: ('partial', 300),
+}
+# 0xDF uses the temperature register's waveform instead of the sensor,
+# hotter waveforms drive the pixels for fewer frames
+TEMPERATURE_PARTIAL_MS = ((100, 200), (50, 260))
+SWRESET_MS = 10
+# SPI transfers shorter than this are accumulated instead of slept
+MIN_SLEEP_S = 0.001
+
+GT1151_PRODUCT_ID = b'1151'
+GT1151_STATUS = 0x814E
+GT1151_POINTS = 0x814F
+GT1151_POINT_SIZE = 8
+GT1151_MAX_POINTS = 5
+
+
+class Emulator:
+    def __init__(self, time_scale=None):
+        self.time_scale = TIME_SCALE if time_scale is None else time_scale
+        self.lock = threading.RLock()
+        self.linewidth = framebuffer.linewidth(WIDTH)
+        self.packer = framebuffer.FramePacker(WIDTH, HEIGHT)
+        self.ram = {0x24: bytearray(b'\xff' * (self.linewidth * HEIGHT)),
+                    0x26: bytearray(b'\xff' * (self.linewidth * HEIGHT))}
+        self.panel = bytearray(b'\xff' * (self.linewidth * HEIGHT))
+        self.pins = {epdconfig.EPD_RST_PIN: 0, epdconfig.EPD_DC_PIN: 0, epdconfig.TRST: 0}
+        self.callbacks = {}
+        self.speed_hz = epdconfig.SPI_SPEED_HZ
+        self.spi_debt = 0.0
+        self.busy_until = 0.0
+        self.refresh_generation = 0
+
+        self.touch_registers = bytearray(0x10000)
+        self.touch_registers[0x8140:0x8144] = GT1151_PRODUCT_ID
+        self.touch_pointer = 0
+
+        self.reset_controller()
+        self.reset_stats()
+
+    # statistics
+
+    def reset_stats(self):
+        with self.lock:
+            self.counters = collections.Counter()
+            self.commands = collections.Counter()
+            self.refreshes = collections.Counter()
+
+    def stats(self):
+        with self.lock:
+            return {"counters": dict(self.counters),
+                    "commands": {'0x%02X' % command: count
+                                 for command, count in sorted(self.commands.items())},
+                    "refreshes": dict(self.refreshes)}
+
+    def image(self):
+        # what the panel shows, as a landscape canvas
+        with self.lock:
+            return self.packer.unpack(bytes(self.panel))
+
+    # timing
+
+    def wait(self, seconds):
+        seconds *= self.time_scale
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def set_busy(self, milliseconds):
+        now = time.monotonic()
+        self.busy_until = max(self.busy_until, now) + milliseconds / 1000.0 * self.time_scale
+        self.counters['busy_ms'] += milliseconds
+        return self.busy_until - now
+
+    def is_busy(self):
+        return time.monotonic() < self.busy_until
+
+    # SSD1680
+
+    def reset_controller(self):
+        self.sleeping = False
+        self.command = None
+        self.params = []
+        self.entry_mode = 0x03
+        self.x_window = (0, self.linewidth - 1)
+        self.y_window = (0, HEIGHT - 1)
+        self.x = 0
+        self.y = 0
+        self.update_control = 0xFF
+        self.registers = {}
+
+    def apply(self, command, params):
+        # parameters are re-applied as each byte arrives, so commands take
+        # effect without waiting for the next one
+        if command == 0x10 and params:
+            self.sleeping = params[0] & 0x03 != 0
+        elif command == 0x11 and params:
+            self.entry_mode = params[0] & 0x07
+        elif command == 0x44 and len(params) >= 2:
+            self.x_window = (params[0] & 0x3F, params[1] & 0x3F)
+        elif command == 0x45 and len(params) >= 4:
+            self.y_window = (params[0] | (params[1] & 0x01) << 8,
+                             params[2] | (params[3] & 0x01) << 8)
+        elif command == 0x4E and params:
+            self.x = params[0] & 0x3F
+        elif command == 0x4F and len(params) >= 2:
+            self.y = params[0] | (params[1] & 0x01) << 8
+        elif command == 0x22 and params:
+            self.update_control = params[0]
+        else:
+            self.registers[command] = list(params)
+
+    def run_command(self, command):
+        if command == 0x12:
+            # SWRESET, RAM keeps its contents
+            self.reset_controller()
+            self.set_busy(SWRESET_MS)
+        elif command == 0x20:
+            self.activate()
+
+    def activate(self):
+        kind, milliseconds = REFRESH_TIMINGS.get(self.update_control, ('partial', 300))
+        if self.update_control == 0xDF:
+            temperature = self.registers.get(0x1A, [25])[0]
+            for threshold, duration in TEMPERATURE_PARTIAL_MS:
+                if temperature >= threshold:
+                    milliseconds = duration
+                    break
+        self.panel[:] = self.ram[0x24]
+        self.refreshes[kind] += 1
+        duration = self.set_busy(milliseconds)
+        self.refresh_generation += 1
+        callback = self.callbacks.get(epdconfig.EPD_BUSY_PIN)
+        if callback is not None:
+            timer = threading.Timer(duration, self.busy_released, (self.refresh_generation,))
+            timer.daemon = True
+            timer.start()
+
+    def busy_released(self, generation):
+        # falling edge of BUSY, unless another refresh extended it meanwhile
+        callback = self.callbacks.get(epdconfig.EPD_BUSY_PIN)
+        if generation == self.refresh_generation and callback is not None:
+            callback()
+
+    def write_ram(self, ram, data):
+        x_start, x_end = self.x_window
+        y_start, y_end = self.y_window
+        if self.entry_mode == 0x03:
+            # x then y increment, the only mode the driver uses: whole row runs
+            offset = 0
+            while offset < len(data):
+                count = min(len(data) - offset, x_end - self.x + 1)
+                if count <= 0:
+                    break
+                start = self.y * self.linewidth + self.x
+                ram[start:start + count] = data[offset:offset + count]
+                offset += count
+                self.x += count
+                if self.x > x_end:
+                    self.x = x_start
+                    self.y = self.y + 1 if self.y < y_end else y_start
+            return
+        x_step = 1 if self.entry_mode & 0x01 else -1
+        y_step = 1 if self.entry_mode & 0x02 else -1
+        for value in data:
+            ram[self.y * self.linewidth + self.x] = value
+            if self.entry_mode & 0x04:
+                self.y += y_step
+                if not y_start <= self.y <= y_end:
+                    self.y = y_start if y_step > 0 else y_end
+                    self.x += x_step
+            else:
+                self.x += x_step
+                if not min(x_start, x_end) <= self.x <= max(x_start, x_end):
+                    self.x = x_start if x_step > 0 else x_end
+                    self.y += y_step
+            self.x %= self.linewidth
+            self.y %= HEIGHT
+
+    def transfer(self, data):
+        with self.lock:
+            self.counters['spi_calls'] += 1
+            self.counters['spi_bytes'] += len(data)
+            self.spi_debt += len(data) * 8.0 / self.speed_hz
+            if self.sleeping:
+                self.counters['ignored_bytes'] += len(data)
+            elif self.pins[epdconfig.EPD_DC_PIN] == 0:
+                for command in data:
+                    self.command = command
+                    self.params = []
+                    self.commands[command] += 1
+                    self.run_command(command)
+            elif self.command in self.ram:
+                self.write_ram(self.ram[self.command], data)
+            elif self.command is not None:
+                self.params.extend(data)
+                self.apply(self.command, self.params)
+            debt, self.spi_debt = self.spi_debt, 0.0
+            if debt * self.time_scale < MIN_SLEEP_S:
+                self.spi_debt = debt
+                debt = 0
+        self.wait(debt)
+
+    # epdconfig interface
+
+    def digital_write(self, pin, value):
+        with self.lock:
+            if pin == epdconfig.EPD_RST_PIN and value and not self.pins[pin]:
+                # rising edge of RST, also how the panel leaves deep sleep
+                self.reset_controller()
+                self.counters['resets'] += 1
+            if pin in self.pins:
+                self.pins[pin] = 1 if value else 0
+
+    def digital_read(self, pin):
+        if pin == epdconfig.EPD_BUSY_PIN:
+            return 1 if self.is_busy() else 0
+        elif pin == epdconfig.INT:
+            return 0
+
+    def digital_wait(self, pin, value, timeout=None):
+        if pin != epdconfig.EPD_BUSY_PIN:
+            return self.digital_read(pin) == value
+        if value:
+            return self.is_busy()
+        remaining = self.busy_until - time.monotonic()
+        if remaining <= 0:
+            return True
+        if timeout is not None and remaining > timeout:
+            time.sleep(timeout)
+            return False
+        time.sleep(remaining)
+        return True
+
+    def gpio_callback(self, pin, callback):
+        with self.lock:
+            if callback is None:
+                self.callbacks.pop(pin, None)
+            else:
+                self.callbacks[pin] = callback
+
+    def delay_ms(self, delaytime):
+        self.wait(delaytime / 1000.0)
+
+    def spi_writebyte(self, data):
+        self.transfer(bytes(data))
+
+    def spi_writebyte2(self, data):
+        if isinstance(data, list):
+            data = bytes(data)
+        self.transfer(memoryview(data).cast('B'))
+
+    def i2c_writebyte(self, reg, value):
+        with self.lock:
+            self.counters['i2c_writes'] += 1
+            self.touch_registers[reg] = value & 0xFF
+
+    def i2c_write(self, reg):
+        with self.lock:
+            self.counters['i2c_writes'] += 1
+            self.touch_pointer = reg
+
+    def i2c_readbyte(self, reg, len):
+        self.i2c_write(reg)
+        with self.lock:
+            self.counters['i2c_reads'] += 1
+            data = list(self.touch_registers[reg:reg + len])
+            self.touch_pointer = reg + len
+        return data
+
+    def i2c_readblock(self, reg, len):
+        with self.lock:
+            self.counters['i2c_reads'] += 1
+            return bytes(self.touch_registers[reg:reg + len])
+
+    def module_init(self, speed_hz=None):
+        self.speed_hz = speed_hz or epdconfig.SPI_SPEED_HZ
+        return 0
+
+    def module_exit(self):
+        with self.lock:
+            self.callbacks.clear()
+
+    # GT1151
+
+    def inject_touch(self, points):
+        '''
+        Load a GT1151 report with points, a list of (x, y) or (x, y, size)
+        in the controller's coordinates, and pulse INT. An empty list
+        reports that every finger was lifted. The INT callback runs on the
+        caller's thread.
+        '''
+        if len(points) > GT1151_MAX_POINTS:
+            raise ValueError("The GT1151 reports at most " + str(GT1151_MAX_POINTS) + " points")
+        with self.lock:
+            self.counters['touch_reports'] += 1
+            for track, point in enumerate(points):
+                x, y = point[0], point[1]
+                size = point[2] if len(point) > 2 else 20
+                start = GT1151_POINTS + track * GT1151_POINT_SIZE
+                self.touch_registers[start:start + GT1151_POINT_SIZE] = bytes(
+                    [track, x & 0xFF, x >> 8, y & 0xFF, y >> 8, size & 0xFF, size >> 8, 0])
+            self.touch_registers[GT1151_STATUS] = 0x80 | len(points)
+            callback = self.callbacks.get(epdconfig.INT)
+        if callback is not None:
+            callback()
+
+    def release_touch(self):
+        self.inject_touch([])
@@ -29,23 +29,57 @@
 
 
 import logging
+import threading
 from . import epdconfig
+from . import framebuffer
+from . import metrics
+from . import tracing
 import numpy as np
 
 # Display resolution
 EPD_WIDTH       = 122
 EPD_HEIGHT      = 250
 
+# Longest a full refresh may hold BUSY before we give up waiting
+BUSY_TIMEOUT_MS = 10000
+
 logger = logging.getLogger(__name__)
 
+class RefreshProfile:
+    '''
+    update_control : Display Update Control (0x22) byte for partial refresh
+    temperature : optional temperature in degrees C written to the
+          temperature register (0x1A) instead of reading the sensor, the
+          controller picks shorter waveforms for higher temperatures
+    '''
+    def __init__(self, update_control, temperature=None):
+        self.update_control = update_control
+        self.temperature = temperature
+
+REFRESH_PROFILES = {
+    # waveform for the measured temperature
+    "quality": RefreshProfile(0xFF),
+    # 0xDF loads the LUT for the temperature register without reading the sensor
+    "balanced": RefreshProfile(0xDF, temperature=50),
+    "fast": RefreshProfile(0xDF, temperature=100),
+}
+DEFAULT_PROFILE = "quality"
+
 class EPD:
-    def __init__(self):
+    def __init__(self, spi_speed_hz=None):
         self.reset_pin = epdconfig.EPD_RST_PIN
         self.dc_pin = epdconfig.EPD_DC_PIN
         self.busy_pin = epdconfig.EPD_BUSY_PIN
         self.cs_pin = epdconfig.EPD_CS_PIN
         self.width = EPD_WIDTH
         self.height = EPD_HEIGHT
+        self.spi_speed_hz = spi_speed_hz
+        self.packer = framebuffer.FramePacker(self.width, self.height)
+        # set while a partial refresh started by TurnOnDisplayPart may still run
+        self.refresh_pending = False
+        # (trace id, start) of a traced partial refresh that hasn't finished
+        self.refresh_trace = None
+        self.refresh_trace_lock = threading.Lock()
         epdconfig.address = 0x14
     
     FULL_UPDATE = 0
@@ -85,22 +119,58 @@ class EPD:
         epdconfig.spi_writebyte([data])
         epdconfig.digital_write(self.cs_pin, 1)
         
+    '''
+    function :send a block of data in as few SPI transactions as possible
+    parameter:
+     data : Write data (bytes, bytearray, list or any buffer)
+    '''
     def send_data2(self, data):
         epdconfig.digital_write(self.dc_pin, 1)
         epdconfig.digital_write(self.cs_pin, 0)
-        epdconfig.spi_writebyte(data)
+        with metrics.SPI_SECONDS.time(), tracing.span('epd.spi'):
+            epdconfig.spi_writebyte2(data)
+        metrics.SPI_BYTES.inc(data.nbytes if hasattr(data, 'nbytes') else len(data))
         epdconfig.digital_write(self.cs_pin, 1)
     
     '''
     function :Wait until the busy_pin goes LOW
     parameter:
     '''
-    def ReadBusy(self):
+    def ReadBusy(self, timeout_ms=BUSY_TIMEOUT_MS):
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 1):      # 0: idle, 1: busy
-            epdconfig.delay_ms(10)  
+        # 0: idle, 1: busy
+        with metrics.BUSY_SECONDS.time(), tracing.span('epd.busy'):
+            idle = epdconfig.digital_wait(self.busy_pin, 0, timeout_ms / 1000.0)
+        if not idle:
+            metrics.BUSY_TIMEOUTS.inc()
+            logger.warning("e-Paper still busy after " + str(timeout_ms) + "ms")
         logger.debug("e-Paper busy release")
 
+    '''
+    function : Wait for a partial refresh started by TurnOnDisplayPart
+    parameter:
+    '''
+    def WaitRefresh(self):
+        if self.refresh_pending:
+            # the wait belongs to the frame being refreshed, not the next one
+            trace = self.refresh_trace
+            with tracing.context(trace[0] if trace is not None else tracing.current()):
+                self.ReadBusy()
+            self.refresh_pending = False
+            self.RefreshDone()
+
+    '''
+    function : Record the end of a traced partial refresh, called on the
+               falling edge of BUSY or by WaitRefresh, whichever is first
+    parameter:
+    '''
+    def RefreshDone(self):
+        with self.refresh_trace_lock:
+            trace, self.refresh_trace = self.refresh_trace, None
+        if trace is not None:
+            epdconfig.gpio_callback(self.busy_pin, None)
+            tracing.record('epd.refresh', trace[1], tracing.now(), trace[0])
+
     '''
     function : Turn On Display
     parameter:
@@ -115,11 +185,18 @@ class EPD:
     function : Turn On Display Part
     parameter:
     '''
-    def TurnOnDisplayPart(self):
+    def TurnOnDisplayPart(self, update_control=0xFF):
         self.send_command(0x22) # Display Update Control
-        self.send_data(0xFF)    # fast:0x0c, quality:0x0f, 0xcf
+        # 0xFF: waveform for the measured temperature (quality)
+        # 0xDF: waveform for the temperature register (balanced, fast)
+        self.send_data(update_control)
         self.send_command(0x20) # Activate Display Update Sequence
-        # self.ReadBusy()
+        # doesn't wait, anything that touches the panel next calls WaitRefresh
+        # first, so the caller can prepare another frame meanwhile
+        self.refresh_pending = True
+        if tracing.enabled:
+            self.refresh_trace = (tracing.current(), tracing.now())
+            epdconfig.gpio_callback(self.busy_pin, self.RefreshDone)
         
     def TurnOnDisplayPart_Wait(self):
         self.send_command(0x22) # Display Update Control
@@ -127,6 +204,30 @@ class EPD:
         self.send_command(0x20) # Activate Display Update Sequence
         self.ReadBusy()
 
+    '''
+    function : Look up a refresh profile by name
+    parameter:
+        name : key of REFRESH_PROFILES, None for the default
+    '''
+    def GetRefreshProfile(self, name=None):
+        if name is None:
+            name = DEFAULT_PROFILE
+        if name not in REFRESH_PROFILES:
+            raise ValueError("Unknown refresh profile " + str(name) +
+                             ", expected one of " + ", ".join(REFRESH_PROFILES))
+        return REFRESH_PROFILES[name]
+
+    '''
+    function : Load the temperature override of a refresh profile
+    parameter:
+        profile : RefreshProfile
+    '''
+    def SetRefreshProfile(self, profile):
+        if profile.temperature is not None:
+            self.send_command(0x1A) # Write to temperature register
+            self.send_data(profile.temperature & 0xFF)
+            self.send_data(0x00)
+
     '''
     function : Setting the display window
     parameter:
@@ -167,8 +268,11 @@ class EPD:
     parameter:
     '''
     def init(self, update):
-        if (epdconfig.module_init() != 0):
+        if (epdconfig.module_init(self.spi_speed_hz) != 0):
             return -1
+
+        # a reset in the middle of a partial refresh corrupts it
+        self.WaitRefresh()
         
         if update == self.FULL_UPDATE:
             # EPD hardware init start
@@ -228,20 +332,15 @@ class EPD:
         image : Image data
     '''
     def getbuffer(self, image):
-        img = image
-        imwidth, imheight = img.size
-        if(imwidth == self.width and imheight == self.height):
-            img = img.rotate(180, expand=True).convert('1')
-        elif(imwidth == self.height and imheight == self.width):
-            # image has correct dimensions, but needs to be rotated
-            img = img.rotate(270, expand=True).convert('1')
-        else:
+        if not self.packer.supports(image.size):
             logger.warning("Wrong image dimensions: must be " + str(self.width) + "x" + str(self.height))
-            # return a blank buffer
-            return [0x00] * (int(self.width/8) * self.height)
+            # return a blank buffer, rows padded like packed frames
+            return bytes(self.packer.linewidth * self.height)
 
-        buf = bytearray(img.tobytes('raw'))
-        return buf
+        # portrait images are rotated 180 degrees, landscape images 270,
+        # the returned buffer is reused by the next call
+        with metrics.PACK_SECONDS.time(), tracing.span('epd.pack'):
+            return self.packer.pack(image)
         
     '''
     function : Sends the image buffer in RAM to e-Paper and displays
@@ -267,7 +366,30 @@ class EPD:
     parameter:
         image : Image data
     '''
-    def displayPartial(self, image):
+    def displayPartial(self, image, profile=None):
+        self.displayPartialWindow(image, 0, 0, self.width - 1, self.height - 1, profile)
+
+    '''
+    function : Sends one window of the image buffer to e-Paper RAM and partial refresh
+    parameter:
+        image : Full image data, as returned by getbuffer
+        x_start : X-axis starting position, a multiple of 8
+        y_start : Y-axis starting position
+        x_end : End position of X-axis
+        y_end : End position of Y-axis
+        profile : name of a refresh profile, see REFRESH_PROFILES
+    '''
+    def displayPartialWindow(self, image, x_start, y_start, x_end, y_end, profile=None):
+        with metrics.REFRESH_SECONDS.labels('partial').time():
+            self._displayPartialWindow(image, x_start, y_start, x_end, y_end, profile)
+
+    def _displayPartialWindow(self, image, x_start, y_start, x_end, y_end, profile):
+        profile = self.GetRefreshProfile(profile)
+        rows = framebuffer.as_rows(image, self.width, self.height)
+        window = np.ascontiguousarray(rows[y_start:y_end + 1, x_start >> 3:(x_end >> 3) + 1])
+
+        # the previous partial refresh may still be running
+        self.WaitRefresh()
         epdconfig.digital_write(self.reset_pin, 0)
         epdconfig.delay_ms(1)
         epdconfig.digital_write(self.reset_pin, 1)  
@@ -283,14 +405,16 @@ class EPD:
         self.send_command(0x11) #data entry mode       
         self.send_data(0x03)
 
-        self.SetWindow(0, 0, self.width - 1, self.height - 1)
-        self.SetCursor(0, 0)
+        self.SetWindow(x_start, y_start, x_end, y_end)
+        self.SetCursor(x_start >> 3, y_start)
+        self.SetRefreshProfile(profile)
 
         self.send_command(0x24) # WRITE_RAM
-        self.send_data2(image)                
-        self.TurnOnDisplayPart()
+        self.send_data2(window)                
+        self.TurnOnDisplayPart(profile.update_control)
         
     def displayPartial_Wait(self, image):
+        self.WaitRefresh()
         epdconfig.digital_write(self.reset_pin, 0)
         epdconfig.delay_ms(1)
         epdconfig.digital_write(self.reset_pin, 1)  
@@ -319,21 +443,22 @@ class EPD:
         image : Image data
     '''
     def displayPartBaseImage(self, image):
-        if self.width%8 == 0:
-            linewidth = int(self.width/8)
-        else:
-            linewidth = int(self.width/8) + 1
-
+        with metrics.REFRESH_SECONDS.labels('full').time():
+            self.WriteBaseImage(image)
+            self.TurnOnDisplay()
+    
+    '''
+    function : Load a base image into both RAMs without refreshing, for a
+               panel that still shows it, e.g. after waking from deep sleep
+    parameter:
+        image : Image data
+    '''
+    def WriteBaseImage(self, image):
         self.send_command(0x24)
-        for j in range(0, self.height):
-            for i in range(0, linewidth):
-                self.send_data(image[i + j * linewidth])   
+        self.send_data2(image)
                 
         self.send_command(0x26)
-        for j in range(0, self.height):
-            for i in range(0, linewidth):
-                self.send_data(image[i + j * linewidth])  
-        self.TurnOnDisplay()
+        self.send_data2(image)
     
     '''
     function : Clear screen
@@ -347,21 +472,21 @@ class EPD:
         # logger.debug(linewidth)
         
         self.send_command(0x24)
-        for j in range(0, self.height):
-            for i in range(0, linewidth):
-                self.send_data(color)
+        self.send_data2(bytes([color]) * (linewidth * self.height))
                 
         self.TurnOnDisplay()
 
     '''
     function : Enter sleep mode
     parameter:
+        delay_ms : time to wait before the panel may be powered down
     '''
-    def sleep(self):
+    def sleep(self, delay_ms=2000):
+        self.WaitRefresh()
         self.send_command(0x10) #enter deep sleep
         self.send_data(0x01)
         
-        epdconfig.delay_ms(2000)
+        epdconfig.delay_ms(delay_ms)
 
     def Dev_exit(self):
         epdconfig.module_exit()
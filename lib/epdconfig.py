@@ -27,11 +27,10 @@
 # THE SOFTWARE.
 #
 
-import gpiozero
+import os
+import sys
+import threading
 import time
-from smbus import SMBus
-import spidev
-import ctypes
 import logging
 
 # e-Paper
@@ -44,97 +43,194 @@ EPD_BUSY_PIN    = 24
 TRST    = 22
 INT     = 27
 
-spi     = spidev.SpiDev(0, 0)
+# SPI
+SPI_SPEED_HZ    = 10000000
+SPI_BUFSIZ_PATH = '/sys/module/spidev/parameters/bufsiz'
+
 address = 0x0
 # address = 0x14
 # address = 0x48
-bus     = SMBus(1)
-
-
-GPIO_RST_PIN    = gpiozero.LED(EPD_RST_PIN)
-GPIO_DC_PIN     = gpiozero.LED(EPD_DC_PIN)
-# GPIO_CS_PIN     = gpiozero.LED(EPD_CS_PIN)
-GPIO_TRST       = gpiozero.LED(TRST)
-
-GPIO_BUSY_PIN   = gpiozero.Button(EPD_BUSY_PIN, pull_up = False)
-GPIO_INT        = gpiozero.Button(INT, pull_up = False)
-
 
-def digital_write(pin, value):
-    if pin == EPD_RST_PIN:
-        if value:
-            GPIO_RST_PIN.on()
-        else:
-            GPIO_RST_PIN.off()
-    elif pin == EPD_DC_PIN:
-        if value:
-            GPIO_DC_PIN.on()
+# raspberrypi, or emulator to run without a panel, see emulator.py
+BACKEND = os.environ.get('EPD_BACKEND', 'raspberrypi')
+
+def _spi_bufsiz():
+    # spidev rejects transfers larger than its kernel buffer (4096 by default)
+    try:
+        with open(SPI_BUFSIZ_PATH) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return 4096
+
+
+class RaspberryPi:
+    # pins and buses are opened on first use rather than at import, see _open
+    DEVICES = ('SPI', 'spi_bufsiz', 'bus', 'GPIO_RST_PIN', 'GPIO_DC_PIN',
+               'GPIO_TRST', 'GPIO_BUSY_PIN', 'GPIO_INT')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._i2c_msg = None
+
+    def __getattr__(self, name):
+        # only called for attributes that aren't set yet
+        if name not in RaspberryPi.DEVICES:
+            raise AttributeError(name)
+        self._open()
+        return self.__dict__[name]
+
+    def _open(self):
+        with self._lock:
+            if 'GPIO_INT' in self.__dict__:
+                return
+            import gpiozero
+            import spidev
+            try:
+                # smbus2 can issue a combined write-then-read transaction
+                from smbus2 import SMBus, i2c_msg
+            except ImportError:
+                from smbus import SMBus
+                i2c_msg = None
+            self._i2c_msg = i2c_msg
+
+            self.SPI = spidev.SpiDev(0, 0)
+            self.spi_bufsiz = _spi_bufsiz()
+            self.bus = SMBus(1)
+
+            self.GPIO_RST_PIN    = gpiozero.LED(EPD_RST_PIN)
+            self.GPIO_DC_PIN     = gpiozero.LED(EPD_DC_PIN)
+            # self.GPIO_CS_PIN     = gpiozero.LED(EPD_CS_PIN)
+            self.GPIO_TRST       = gpiozero.LED(TRST)
+
+            self.GPIO_BUSY_PIN   = gpiozero.Button(EPD_BUSY_PIN, pull_up = False)
+            # set last, _open checks it to see whether everything is open
+            self.GPIO_INT        = gpiozero.Button(INT, pull_up = False)
+
+    def digital_write(self, pin, value):
+        if pin == EPD_RST_PIN:
+            if value:
+                self.GPIO_RST_PIN.on()
+            else:
+                self.GPIO_RST_PIN.off()
+        elif pin == EPD_DC_PIN:
+            if value:
+                self.GPIO_DC_PIN.on()
+            else:
+                self.GPIO_DC_PIN.off()
+        # elif pin == EPD_CS_PIN:
+        #     if value:
+        #         self.GPIO_CS_PIN.on()
+        #     else:
+        #         self.GPIO_CS_PIN.off()
+        elif pin == TRST:
+            if value:
+                self.GPIO_TRST.on()
+            else:
+                self.GPIO_TRST.off()
+
+    def digital_read(self, pin):
+        if pin == EPD_BUSY_PIN:
+            return self.GPIO_BUSY_PIN.value
+        elif pin == INT:
+            return self.GPIO_INT.value
+
+    def digital_wait(self, pin, value, timeout=None):
+        # blocks on the pin's edge event rather than polling, timeout in seconds,
+        # returns False if the pin didn't reach value in time
+        if pin == EPD_BUSY_PIN:
+            device = self.GPIO_BUSY_PIN
+        elif pin == INT:
+            device = self.GPIO_INT
         else:
-            GPIO_DC_PIN.off()
-    # elif pin == EPD_CS_PIN:
-    #     if value:
-    #         GPIO_CS_PIN.on()
-    #     else:
-    #         GPIO_CS_PIN.off()
-    elif pin == TRST:
+            raise ValueError("No edge wait for pin " + str(pin))
         if value:
-            GPIO_TRST.on()
-        else:
-            GPIO_TRST.off()
-
-def digital_read(pin):
-    if pin == EPD_BUSY_PIN:
-        return GPIO_BUSY_PIN.value
-    elif pin == INT:
-        return GPIO_INT.value
-
-def delay_ms(delaytime):
-    time.sleep(delaytime / 1000.0)
-
-def spi_writebyte(data):
-    spi.writebytes(data)
-
-def spi_writebyte2(data):
-    spi.writebytes2(data)
-
-def i2c_writebyte(reg, value):
-    bus.write_word_data(address, (reg>>8) & 0xff, (reg & 0xff) | ((value & 0xff) << 8))
-
-def i2c_write(reg):
-    bus.write_byte_data(address, (reg>>8) & 0xff, reg & 0xff)
-
-def i2c_readbyte(reg, len):
-    i2c_write(reg)
-    rbuf = []
-    for i in range(len):
-        rbuf.append(int(bus.read_byte(address)))
-    return rbuf
-
-def module_init():
-   
-    spi.max_speed_hz = 10000000
-    spi.mode = 0b00
-    
-    return 0
-
-def module_exit():
-    logging.debug("spi end")
-    spi.close()
-    bus.close()
+            return device.wait_for_press(timeout)
+        return device.wait_for_release(timeout)
+
+    def gpio_callback(self, pin, callback):
+        # runs callback on gpiozero's event thread on every falling edge,
+        # passing None removes it
+        if pin == INT:
+            self.GPIO_INT.when_released = callback
+        elif pin == EPD_BUSY_PIN:
+            self.GPIO_BUSY_PIN.when_released = callback
+
+    def delay_ms(self, delaytime):
+        time.sleep(delaytime / 1000.0)
+
+    def spi_writebyte(self, data):
+        self.SPI.writebytes(data)
+
+    def spi_writebyte2(self, data):
+        if not isinstance(data, list):
+            data = memoryview(data).cast('B')
+        for start in range(0, len(data), self.spi_bufsiz):
+            self.SPI.writebytes2(data[start:start + self.spi_bufsiz])
+
+    def i2c_writebyte(self, reg, value):
+        self.bus.write_word_data(address, (reg>>8) & 0xff, (reg & 0xff) | ((value & 0xff) << 8))
+
+    def i2c_write(self, reg):
+        self.bus.write_byte_data(address, (reg>>8) & 0xff, reg & 0xff)
+
+    def i2c_readbyte(self, reg, len):
+        self.i2c_write(reg)
+        rbuf = []
+        for i in range(len):
+            rbuf.append(int(self.bus.read_byte(address)))
+        return rbuf
+
+    def i2c_readblock(self, reg, len):
+        # register address write and data read in a single repeated-start transfer
+        # opens the bus first, it decides whether i2c_msg is available
+        bus = self.bus
+        if self._i2c_msg is None:
+            return bytes(self.i2c_readbyte(reg, len))
+        write = self._i2c_msg.write(address, [(reg>>8) & 0xff, reg & 0xff])
+        read = self._i2c_msg.read(address, len)
+        bus.i2c_rdwr(write, read)
+        return bytes(list(read))
+
+    def module_init(self, speed_hz=None):
+       
+        self.SPI.max_speed_hz = speed_hz or SPI_SPEED_HZ
+        self.SPI.mode = 0b00
         
-    logging.debug("close 5V, Module enters 0 power consumption ...")
-    GPIO_RST_PIN.off()
-    GPIO_DC_PIN.off()
-    # GPIO_CS_PIN.off()
-    GPIO_TRST.off()
-
-    GPIO_RST_PIN.close()
-    GPIO_DC_PIN.close()
-    # GPIO_CS_PIN.close()
-    GPIO_TRST.close()
-
-    GPIO_BUSY_PIN.close()
-    GPIO_INT.close()
+        return 0
+
+    def module_exit(self):
+        if 'GPIO_INT' not in self.__dict__:
+            # nothing was ever opened
+            return
+        logging.debug("spi end")
+        self.SPI.close()
+        self.bus.close()
+            
+        logging.debug("close 5V, Module enters 0 power consumption ...")
+        self.GPIO_RST_PIN.off()
+        self.GPIO_DC_PIN.off()
+        # self.GPIO_CS_PIN.off()
+        self.GPIO_TRST.off()
+
+        self.GPIO_RST_PIN.close()
+        self.GPIO_DC_PIN.close()
+        # self.GPIO_CS_PIN.close()
+        self.GPIO_TRST.close()
+
+        self.GPIO_BUSY_PIN.close()
+        self.GPIO_INT.close()
+
+
+if BACKEND == 'emulator':
+    from .emulator import Emulator
+    implementation = Emulator()
+elif BACKEND == 'raspberrypi':
+    implementation = RaspberryPi()
+else:
+    raise RuntimeError("Unknown EPD_BACKEND " + BACKEND + ", expected raspberrypi or emulator")
+
+for func in [x for x in dir(implementation) if not x.startswith('_') and callable(getattr(implementation, x))]:
+    setattr(sys.modules[__name__], func, getattr(implementation, func))
 
 
 ### END OF FILE ###
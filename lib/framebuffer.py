@@ -0,0 +1,112 @@
+import hashlib
+import threading
+import numpy as np
+from PIL import Image
+
+
+# set bits in every byte value
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def linewidth(width):
+    # bytes per panel row, rows are padded to a whole byte
+    return (width + 7) // 8
+
+
+def as_array(buffer):
+    if isinstance(buffer, (list, np.ndarray)):
+        return np.asarray(buffer, dtype=np.uint8).ravel()
+    return np.frombuffer(buffer, dtype=np.uint8)
+
+
+def as_rows(buffer, width, height):
+    return as_array(buffer).reshape(height, linewidth(width))
+
+
+def digest(buffer):
+    return hashlib.blake2b(as_array(buffer), digest_size=16).digest()
+
+
+def changed_pixels(old, new):
+    # number of pixels that differ between two packed framebuffers
+    if old is None:
+        return len(as_array(new)) * 8
+    return int(POPCOUNT[np.bitwise_xor(as_array(old), as_array(new))].sum(dtype=np.int64))
+
+
+def changed_window(old, new, width, height):
+    '''
+    Compare two packed framebuffers and return the smallest
+    (x_start, y_start, x_end, y_end) window, in pixels, that covers every
+    changed byte. x values are aligned to the panel's 8 pixel RAM columns.
+    Returns None when nothing changed.
+    '''
+    if old is None:
+        return (0, 0, linewidth(width) * 8 - 1, height - 1)
+
+    diff = as_rows(old, width, height) != as_rows(new, width, height)
+    rows = np.flatnonzero(diff.any(axis=1))
+    if rows.size == 0:
+        return None
+    columns = np.flatnonzero(diff.any(axis=0))
+
+    return (int(columns[0]) * 8, int(rows[0]),
+            int(columns[-1]) * 8 + 7, int(rows[-1]))
+
+
+class FramePacker:
+    '''
+    Packs 1-bit canvases into the panel's portrait row layout.
+
+    The per-orientation source index and padding tables are computed once,
+    so packing a frame is a single gather plus np.packbits into a buffer
+    that is reused between calls. The returned bytearray is overwritten by
+    the next pack, callers that keep a frame must copy it.
+    '''
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.linewidth = linewidth(width)
+        self.lock = threading.RLock()
+        self.buffer = bytearray(self.linewidth * height)
+        self._out = np.frombuffer(self.buffer, dtype=np.uint8)
+        self._bits = np.empty((height, self.linewidth * 8), dtype=bool)
+
+        x = np.arange(self.linewidth * 8)[np.newaxis, :]
+        y = np.arange(height)[:, np.newaxis]
+        self._mask = np.broadcast_to(x < width, self._bits.shape)
+        xs = np.minimum(x, width - 1)
+        self._tables = {
+            # portrait canvas, rotated 180 degrees
+            (width, height): (height - 1 - y) * width + (width - 1 - xs),
+            # landscape canvas, rotated 90 degrees clockwise
+            (height, width): (width - 1 - xs) * height + y,
+        }
+
+    def supports(self, size):
+        return size in self._tables
+
+    def pack(self, image):
+        if image.mode != '1':
+            image = image.convert('1')
+        pixels = np.asarray(image).ravel()
+        with self.lock:
+            np.take(pixels, self._tables[image.size], out=self._bits)
+            np.logical_and(self._bits, self._mask, out=self._bits)
+            self._out[:] = np.packbits(self._bits, axis=1).ravel()
+        return self.buffer
+
+    def pack_bytes(self, image):
+        # pack into an immutable copy, for frames kept beyond the next pack
+        with self.lock:
+            return bytes(self.pack(image))
+
+    def unpack(self, buffer):
+        # inverse of pack, returns a landscape canvas
+        height, width = self.width, self.height
+        table = self._tables[(width, height)]
+        bits = np.unpackbits(as_array(buffer)).reshape(self._bits.shape)
+        pixels = np.zeros(width * height, dtype=bool)
+        pixels[table[self._mask]] = bits[self._mask]
+        return Image.fromarray(pixels.reshape(height, width))
@@ -1,5 +1,11 @@
 import logging
+import struct
 from . import epdconfig as config
+from . import metrics
+from . import tracing
+
+# track id, x, y, size, reserved
+POINT_RECORD = struct.Struct('<BHHHx')
 
 class GT_Development:
     def __init__(self):
@@ -24,6 +30,10 @@ class GT1151:
 
     def digital_read(self, pin):
         return config.digital_read(pin)
+
+    def set_int_callback(self, callback):
+        # INT is pulled low by the GT1151 whenever a new report is ready
+        config.gpio_callback(self.INT, callback)
     
     def GT_Reset(self):
         config.digital_write(self.TRST, 1)
@@ -39,6 +49,9 @@ class GT1151:
     def GT_Read(self, Reg, len):
         return config.i2c_readbyte(Reg, len)
          
+    def GT_ReadBlock(self, Reg, len):
+        return config.i2c_readblock(Reg, len)
+
     def GT_ReadVersion(self):
         buf = self.GT_Read(0x8140, 4)
         print(buf)
@@ -48,37 +61,42 @@ class GT1151:
         self.GT_ReadVersion()
 
     def GT_Scan(self, GT_Dev, GT_Old):
-        buf = []
+        # returns True when GT_Dev was updated from a new report
+        with metrics.SCAN_SECONDS.time(), tracing.span('touch.scan'):
+            return self._GT_Scan(GT_Dev, GT_Old)
+
+    def _GT_Scan(self, GT_Dev, GT_Old):
         mask = 0x00
         
         if(GT_Dev.Touch == 1):
             GT_Dev.Touch = 0
-            buf = self.GT_Read(0x814E, 1)
+            # status byte and the first point record in one transfer
+            buf = self.GT_ReadBlock(0x814E, 1 + POINT_RECORD.size)
             
             if(buf[0]&0x80 == 0x00):
                 self.GT_Write(0x814E, mask)
                 config.delay_ms(10)
+                return False
                 
-            else:
-                GT_Dev.TouchpointFlag = buf[0]&0x80
-                GT_Dev.TouchCount = buf[0]&0x0f
-                
-                if(GT_Dev.TouchCount > 5 or GT_Dev.TouchCount < 1):
-                    self.GT_Write(0x814E, mask)
-                    return
-                    
-                buf = self.GT_Read(0x814F, GT_Dev.TouchCount*8)
+            GT_Dev.TouchpointFlag = buf[0]&0x80
+            GT_Dev.TouchCount = buf[0]&0x0f
+            
+            if(GT_Dev.TouchCount > 5 or GT_Dev.TouchCount < 1):
                 self.GT_Write(0x814E, mask)
+                return GT_Dev.TouchCount == 0
                 
-                GT_Old.X[0] = GT_Dev.X[0];
-                GT_Old.Y[0] = GT_Dev.Y[0];
-                GT_Old.S[0] = GT_Dev.S[0];
-                
-                for i in range(0, GT_Dev.TouchCount, 1):
-                    GT_Dev.Touchkeytrackid[i] = buf[0 + 8*i] 
-                    GT_Dev.X[i] = (buf[2 + 8*i] << 8) + buf[1 + 8*i]
-                    GT_Dev.Y[i] = (buf[4 + 8*i] << 8) + buf[3 + 8*i]
-                    GT_Dev.S[i] = (buf[6 + 8*i] << 8) + buf[5 + 8*i]
+            if(GT_Dev.TouchCount > 1):
+                buf += self.GT_ReadBlock(0x814F + POINT_RECORD.size,
+                                         (GT_Dev.TouchCount - 1) * POINT_RECORD.size)
+            self.GT_Write(0x814E, mask)
+            
+            GT_Old.X[0] = GT_Dev.X[0]
+            GT_Old.Y[0] = GT_Dev.Y[0]
+            GT_Old.S[0] = GT_Dev.S[0]
+            
+            for i in range(GT_Dev.TouchCount):
+                (GT_Dev.Touchkeytrackid[i], GT_Dev.X[i], GT_Dev.Y[i],
+                 GT_Dev.S[i]) = POINT_RECORD.unpack_from(buf, 1 + POINT_RECORD.size * i)
+            return True
 
-                print(GT_Dev.X[0], GT_Dev.Y[0], GT_Dev.S[0])
-                
\ No newline at end of file
+        return False
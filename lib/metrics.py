@@ -0,0 +1,222 @@
+import bisect
+import threading
+import time
+
+
+# Counters and latency histograms for the display and touch stages, kept in
+# process and rendered in the Prometheus text exposition format for /metrics.
+# Recording is a lock and a few additions, cheap enough for the SPI path.
+
+# seconds, from a small SPI write up to a slow full refresh
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+    # appended to the name in every exposed line, HELP and TYPE included
+    suffix = ''
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.children = {}
+        if not self.labelnames:
+            # exposed as zero before anything is recorded
+            self.default()
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        if len(values) != len(self.labelnames):
+            raise ValueError(self.name + " expects labels " + ", ".join(self.labelnames))
+        values = tuple(str(value) for value in values)
+        with self.lock:
+            child = self.children.get(values)
+            if child is None:
+                child = self.children[values] = self.child()
+        return child
+
+    def default(self):
+        # unlabelled metrics are their own single child
+        return self.labels()
+
+    def expose(self):
+        name = self.name + self.suffix
+        lines = ['# HELP %s %s' % (name, self.documentation),
+                 '# TYPE %s %s' % (name, self.kind)]
+        with self.lock:
+            children = sorted(self.children.items())
+        for values, child in children:
+            lines.extend(child.expose(name, format_labels(self.labelnames, values), values,
+                                      self.labelnames))
+        return lines
+
+
+class CounterValue:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def expose(self, name, labels, values, labelnames):
+        return ['%s%s %s' % (name, labels, format_value(self.value))]
+
+
+class Counter(Metric):
+    kind = 'counter'
+    suffix = '_total'
+    child = CounterValue
+
+    def inc(self, amount=1):
+        self.default().inc(amount)
+
+
+class HistogramValue:
+    def __init__(self, buckets):
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            if index < len(self.counts):
+                self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def time(self):
+        return Timer(self)
+
+    def expose(self, name, labels, values, labelnames):
+        with self.lock:
+            counts, count, total = list(self.counts), self.count, self.sum
+        lines = []
+        cumulative = 0
+        for bound, bucket in zip(self.buckets, counts):
+            cumulative += bucket
+            lines.append('%s_bucket%s %d' % (
+                name, format_labels(labelnames, values, [('le', format_value(bound))]), cumulative))
+        lines.append('%s_bucket%s %d' % (
+            name, format_labels(labelnames, values, [('le', '+Inf')]), count))
+        lines.append('%s_sum%s %s' % (name, labels, format_value(total)))
+        lines.append('%s_count%s %d' % (name, labels, count))
+        return lines
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.default().observe(value)
+
+    def time(self):
+        return self.default().time()
+
+
+class Timer:
+    # context manager observing the time spent in its block
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError("Metric " + metric.name + " is already registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def expose(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def expose():
+    return REGISTRY.expose()
+
+
+# display
+DECODE_SECONDS = histogram(
+    'epd_decode_seconds', 'Time spent decoding uploaded images.')
+PREPROCESS_SECONDS = histogram(
+    'epd_preprocess_seconds', 'Time spent fitting and dithering uploads in the worker pool.')
+PACK_SECONDS = histogram(
+    'epd_pack_seconds', 'Time spent packing canvases into the panel layout (getbuffer).')
+SPI_SECONDS = histogram(
+    'epd_spi_seconds', 'Time spent in bulk SPI transfers.')
+SPI_BYTES = counter(
+    'epd_spi_bytes', 'Bytes sent to the panel in bulk SPI transfers.')
+BUSY_SECONDS = histogram(
+    'epd_busy_seconds', 'Time spent waiting for the panel BUSY line.')
+BUSY_TIMEOUTS = counter(
+    'epd_busy_timeouts', 'BUSY waits that timed out.')
+REFRESH_SECONDS = histogram(
+    'epd_refresh_seconds', 'Time spent sending a refresh to the panel, by type.', ['type'])
+RENDER_SECONDS = histogram(
+    'epd_render_seconds', 'Time the display thread spent on a frame, from pack to refresh.')
+FRAMES = counter(
+    'epd_frames', 'Frames handed to the display thread, by outcome.', ['outcome'])
+
+# touch
+SCAN_SECONDS = histogram(
+    'touch_scan_seconds', 'Time spent reading and decoding a GT1151 report (GT_Scan).')
+TOUCH_SAMPLES = counter(
+    'touch_samples', 'Touch samples read from the GT1151, by outcome.', ['outcome'])
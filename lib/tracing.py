@@ -0,0 +1,157 @@
+import collections
+import itertools
+import os
+import threading
+import time
+
+
+# Opt-in span recording for the touch-to-pixel path. Every touch report
+# read after a GT1151 INT edge gets a trace id; the id travels with the
+# touch event, the frame a client sends back and the refresh that shows
+# it, so each stage's span can be tied to the touch that caused it.
+# Spans are kept in a bounded ring buffer and exported as Chrome trace
+# JSON, which chrome://tracing and ui.perfetto.dev both open.
+
+CAPACITY = 10000
+
+_lock = threading.Lock()
+_spans = collections.deque(maxlen=CAPACITY)
+_ids = itertools.count(1)
+_local = threading.local()
+enabled = False
+
+
+def now():
+    return time.perf_counter_ns()
+
+
+def start(capacity=CAPACITY):
+    global _spans, enabled
+    with _lock:
+        _spans = collections.deque(maxlen=capacity)
+        enabled = True
+
+
+def stop():
+    global enabled
+    enabled = False
+
+
+def new_trace():
+    # None while tracing is off, so callers can pass it along unconditionally
+    return next(_ids) if enabled else None
+
+
+def current():
+    return getattr(_local, 'trace_id', None)
+
+
+class Context:
+    # makes trace_id the current trace of this thread for the block
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+
+    def __enter__(self):
+        self.previous = current()
+        _local.trace_id = self.trace_id
+        return self
+
+    def __exit__(self, *exc):
+        _local.trace_id = self.previous
+        return False
+
+
+def context(trace_id):
+    return Context(trace_id)
+
+
+def record(name, start_ns, end_ns, trace_id=None, **args):
+    if not enabled:
+        return
+    if trace_id is None:
+        trace_id = current()
+    span = (name, start_ns, end_ns - start_ns, trace_id,
+            threading.get_ident(), threading.current_thread().name, args)
+    with _lock:
+        _spans.append(span)
+
+
+def instant(name, trace_id=None, **args):
+    timestamp = now()
+    record(name, timestamp, timestamp, trace_id, **args)
+
+
+class Span:
+    def __init__(self, name, trace_id, args):
+        self.name = name
+        self.trace_id = trace_id
+        self.args = args
+
+    def __enter__(self):
+        self.start = now()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, self.start, now(), self.trace_id, **self.args)
+        return False
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(name, trace_id=None, **args):
+    # nothing is allocated while tracing is off
+    if not enabled:
+        return NULL_SPAN
+    return Span(name, trace_id, args)
+
+
+def stats():
+    with _lock:
+        return {"enabled": enabled, "spans": len(_spans), "capacity": _spans.maxlen}
+
+
+def export():
+    '''
+    Returns the recorded spans in the Chrome trace event format. Spans of
+    the same trace are linked with flow events, so a touch and the refresh
+    it caused are connected by arrows across threads.
+    '''
+    with _lock:
+        spans = sorted(_spans, key=lambda span: span[1])
+    pid = os.getpid()
+    events = []
+    threads = {}
+    traces = collections.defaultdict(list)
+    for name, start_ns, duration_ns, trace_id, tid, thread_name, args in spans:
+        threads[tid] = thread_name
+        event = {"name": name, "cat": "epd", "ph": "X", "pid": pid, "tid": tid,
+                 "ts": start_ns / 1000.0, "dur": duration_ns / 1000.0, "args": dict(args)}
+        if trace_id is not None:
+            event["args"]["trace_id"] = trace_id
+            traces[trace_id].append(event)
+        events.append(event)
+
+    for trace_id, members in traces.items():
+        for index, member in enumerate(members):
+            if len(members) == 1:
+                break
+            phase = "s" if index == 0 else "f" if index == len(members) - 1 else "t"
+            flow = {"name": "trace", "cat": "epd", "ph": phase, "id": trace_id,
+                    "pid": pid, "tid": member["tid"], "ts": member["ts"]}
+            if phase == "f":
+                flow["bp"] = "e"
+            events.append(flow)
+
+    for tid, thread_name in threads.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                       "args": {"name": thread_name}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
@@ -0,0 +1,127 @@
+import asyncio
+import collections
+import hashlib
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image, ImageOps
+
+from lib import metrics
+
+
+FITS = ("contain", "cover", "stretch")
+DITHERS = ("floyd-steinberg", "bayer", "threshold")
+
+# 8x8 ordered dither thresholds, scaled to 0-255
+BAYER_8 = np.array([
+    [0, 32, 8, 40, 2, 34, 10, 42],
+    [48, 16, 56, 24, 50, 18, 58, 26],
+    [12, 44, 4, 36, 14, 46, 6, 38],
+    [60, 28, 52, 20, 62, 30, 54, 22],
+    [3, 35, 11, 43, 1, 33, 9, 41],
+    [51, 19, 59, 27, 49, 17, 57, 25],
+    [15, 47, 7, 39, 13, 45, 5, 37],
+    [63, 31, 55, 23, 61, 29, 53, 21],
+], dtype=np.float32) * 4 + 2
+
+
+def fit_image(image, size, fit):
+    # portrait images of the panel's size are packed as they are
+    if image.size in (size, size[::-1]):
+        return image
+    if fit == "stretch":
+        return image.resize(size)
+    if fit == "cover":
+        return ImageOps.fit(image, size)
+    # contain: letterbox on white
+    contained = ImageOps.contain(image, size)
+    canvas = Image.new('L', size, 255)
+    canvas.paste(contained, ((size[0] - contained.width) // 2,
+                             (size[1] - contained.height) // 2))
+    return canvas
+
+
+def to_grayscale(image):
+    if image.mode == '1':
+        return image
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        # transparent areas become white paper
+        image = image.convert('RGBA')
+        background = Image.new('RGBA', image.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, image)
+    return image.convert('L')
+
+
+def dither_image(image, dither):
+    if image.mode == '1':
+        return image
+    if dither == "floyd-steinberg":
+        return image.convert('1')
+    gray = np.asarray(image, dtype=np.float32)
+    if dither == "threshold":
+        bits = gray >= 128
+    else:
+        height, width = gray.shape
+        thresholds = np.tile(BAYER_8, (height // 8 + 1, width // 8 + 1))[:height, :width]
+        bits = gray > thresholds
+    return Image.fromarray(bits)
+
+
+def prepare_image(image_data, size, fit, dither):
+    # runs in a worker process, returns a 1-bit image as (size, raw bytes)
+    image = Image.open(io.BytesIO(image_data))
+    image = ImageOps.exif_transpose(image)
+    image = dither_image(fit_image(to_grayscale(image), size, fit), dither)
+    return image.size, image.tobytes()
+
+
+class Preprocessor:
+    # Fits, resizes and dithers uploads in a process pool so neither the
+    # event loop nor the display thread spends seconds on a photo. Results
+    # are cached by input hash and options.
+
+    CACHE_SIZE = 32
+    WORKERS = 1
+
+    def __init__(self, size, workers=WORKERS, cache_size=CACHE_SIZE):
+        self.size = size
+        self.workers = workers
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+        self.pool = None
+
+    def executor(self):
+        # spawned rather than forked, the parent runs hardware threads
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"))
+        return self.pool
+
+    async def process(self, image_data, fit="contain", dither="floyd-steinberg"):
+        if fit not in FITS:
+            raise ValueError("Unknown fit " + str(fit) + ", expected one of " + ", ".join(FITS))
+        if dither not in DITHERS:
+            raise ValueError("Unknown dither " + str(dither) + ", expected one of " + ", ".join(DITHERS))
+
+        key = (hashlib.sha256(image_data).digest(), fit, dither)
+        result = self.cache.get(key)
+        if result is None:
+            loop = asyncio.get_running_loop()
+            with metrics.PREPROCESS_SECONDS.time():
+                result = await loop.run_in_executor(
+                    self.executor(), prepare_image, image_data, self.size, fit, dither)
+            self.cache[key] = result
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(key)
+
+        size, data = result
+        return Image.frombytes('1', size, data)
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
@@ -0,0 +1,71 @@
+import collections
+import threading
+
+
+class ScreenCache:
+    # Packed framebuffers stored under client-chosen names. Once the stored
+    # screens pass memory_budget bytes the least recently used ones are
+    # evicted. At about 4 KB a screen the default keeps a few thousand,
+    # a small slice of a 512 MB Pi Zero. Screens are packed with the
+    # cache's own packer, preloading runs off the display thread and
+    # mustn't reuse the buffer of the frame being shown.
+
+    MEMORY_BUDGET = 16 * 1024 * 1024
+
+    def __init__(self, packer, memory_budget=MEMORY_BUDGET):
+        self.packer = packer
+        self.memory_budget = memory_budget
+        self.screens = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def entry_size(self, name, buffer):
+        return len(name) + len(buffer)
+
+    def pack(self, name, image):
+        self.put(name, self.packer.pack_bytes(image))
+
+    def put(self, name, buffer):
+        buffer = bytes(buffer)
+        with self.lock:
+            self.discard(name)
+            self.screens[name] = buffer
+            self.size += self.entry_size(name, buffer)
+            while self.size > self.memory_budget and len(self.screens) > 1:
+                evicted, evicted_buffer = self.screens.popitem(last=False)
+                self.size -= self.entry_size(evicted, evicted_buffer)
+                self.evictions += 1
+
+    def get(self, name):
+        with self.lock:
+            buffer = self.screens.get(name)
+            if buffer is None:
+                self.misses += 1
+                return None
+            self.screens.move_to_end(name)
+            self.hits += 1
+            return buffer
+
+    def remove(self, name):
+        with self.lock:
+            return self.discard(name)
+
+    def discard(self, name):
+        # callers must hold lock
+        buffer = self.screens.pop(name, None)
+        if buffer is None:
+            return False
+        self.size -= self.entry_size(name, buffer)
+        return True
+
+    def stats(self):
+        with self.lock:
+            return {"screens": len(self.screens),
+                    "size": self.size,
+                    "memory_budget": self.memory_budget,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions}
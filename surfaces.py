@@ -0,0 +1,119 @@
+import threading
+
+from PIL import Image
+
+
+class Surface:
+    # an app's last frame, packed
+    def __init__(self, name, buffer):
+        self.name = name
+        self.buffer = buffer
+        self.frames = 0
+
+
+class SurfaceManager:
+    # One retained packed frame per app plus a z-order, bottom to top. The
+    # top surface has focus: it is the one on the panel and the only one
+    # receiving touch events. Frames from other apps only update their
+    # surface, and focusing an app pushes its surface as it is, so
+    # switching costs one partial refresh and no re-upload. A frame
+    # without an app can take the panel meanwhile, then no surface is
+    # showing until the focused app sends a frame or an app is focused.
+
+    MAX_SURFACES = 16
+
+    def __init__(self, packer, max_surfaces=MAX_SURFACES):
+        self.packer = packer
+        self.max_surfaces = max_surfaces
+        self.surfaces = {}
+        self.order = []
+        self.lock = threading.Lock()
+        self.switches = 0
+        # the app whose surface is on the panel, touch events go to it
+        self.showing = None
+
+    @property
+    def focused(self):
+        order = self.order
+        return order[-1] if order else None
+
+    def blank(self):
+        # packed like any frame, with the row padding bits clear
+        packer = self.packer
+        return packer.pack_bytes(Image.new('1', (packer.height, packer.width), 255))
+
+    def get(self, name):
+        # callers must hold lock
+        surface = self.surfaces.get(name)
+        if surface is None:
+            raise ValueError("No surface for app " + str(name))
+        return surface
+
+    def surface(self, name):
+        # callers must hold lock. Only an app's frames create its surface,
+        # new surfaces start blank below the others
+        surface = self.surfaces.get(name)
+        if surface is None:
+            if len(self.surfaces) >= self.max_surfaces:
+                raise ValueError("Too many apps, at most " + str(self.max_surfaces) +
+                                 " can have a surface")
+            surface = self.surfaces[name] = Surface(name, self.blank())
+            self.order.insert(0, name)
+        return surface
+
+    def update(self, name, buffer):
+        # stores the app's new frame, returns True if it should be shown
+        with self.lock:
+            surface = self.surface(name)
+            surface.buffer = bytes(buffer)
+            surface.frames += 1
+            if self.focused != name:
+                return False
+            self.showing = name
+            return True
+
+    def release(self):
+        # a frame without an app took the panel
+        with self.lock:
+            self.showing = None
+
+    def canvas(self, name):
+        # the app's last frame as a landscape canvas, for drawing on
+        with self.lock:
+            surface = self.surfaces.get(name)
+            buffer = self.blank() if surface is None else surface.buffer
+        return self.packer.unpack(buffer)
+
+    def focus(self, name):
+        # raises the app to the top, returns the buffer to show
+        with self.lock:
+            surface = self.get(name)
+            if self.focused != name:
+                self.order.remove(name)
+                self.order.append(name)
+                self.switches += 1
+            self.showing = name
+            return surface.buffer
+
+    def remove(self, name):
+        # returns the buffer to show if the app was on the panel: the surface
+        # of the app below it, or a blank frame if it was the last one
+        with self.lock:
+            self.get(name)
+            del self.surfaces[name]
+            self.order.remove(name)
+            if self.showing != name:
+                return None
+            self.showing = self.focused
+            if self.showing is not None:
+                return self.surfaces[self.showing].buffer
+            return self.blank()
+
+    def stats(self):
+        with self.lock:
+            return {"focused": self.focused,
+                    "showing": self.showing,
+                    "order": list(self.order),
+                    "switches": self.switches,
+                    "frames": {name: surface.frames
+                               for name, surface in self.surfaces.items()}}
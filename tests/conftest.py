@@ -0,0 +1,31 @@
+import os
+import sys
+import time
+
+import pytest
+
+# the suite runs against the emulated panel, with every modelled wait
+# disabled, see lib/emulator.py
+os.environ['EPD_BACKEND'] = 'emulator'
+os.environ['EPD_EMULATOR_TIME_SCALE'] = '0'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+
+@pytest.fixture
+def interface():
+    from EPaper import EPaperInterface
+    interface = EPaperInterface()
+    assert interface.ready.wait(5), interface.startup_error
+    yield interface
+    interface.shutdown()
+
+
+@pytest.fixture
+def wait_until():
+    def wait_until(predicate, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            assert time.monotonic() < deadline, "timed out"
+            time.sleep(0.001)
+    return wait_until
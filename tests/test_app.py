@@ -0,0 +1,26 @@
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+
+@pytest.fixture(scope='module')
+def api():
+    import app
+    with TestClient(app.app) as client:
+        assert app.interface.ready.wait(5), app.interface.startup_error
+        yield app, client
+    app.interface.shutdown()
+
+
+def test_websocket_closes_when_pushing_fails(api, monkeypatch):
+    app, client = api
+
+    async def send_json(self, data, mode="text"):
+        raise RuntimeError("send failed")
+
+    with client.websocket_connect('/screen_interaction') as websocket:
+        monkeypatch.setattr(WebSocket, 'send_json', send_json)
+        app.touch_events.publish({"did_tap": True, "app": None})
+        with pytest.raises(WebSocketDisconnect) as disconnect:
+            websocket.receive_json()
+        assert disconnect.value.code == 1011
@@ -0,0 +1,96 @@
+import io
+
+import pytest
+from PIL import Image, ImageDraw
+
+from EPaper import Frame
+from lib import epdconfig
+from lib import framebuffer
+
+
+def canvas(offset):
+    canvas = Image.new('1', (250, 122), 255)
+    ImageDraw.Draw(canvas).rectangle((10 + offset, 10, 60 + offset, 60), fill=0)
+    return canvas
+
+
+def shown(interface):
+    return interface.rendered_frames + interface.skipped_frames
+
+
+def test_queue_frame_keeps_the_latest(interface, wait_until):
+    before = shown(interface)
+    coalesced = interface.coalesced_frames
+    # the display thread can't take a frame while render_condition is held
+    with interface.render_condition:
+        for offset in (0, 20, 40):
+            interface.queue_frame(Frame(canvas=canvas(offset)))
+    wait_until(lambda: epdconfig.image().tobytes() == canvas(40).tobytes())
+
+    assert interface.coalesced_frames == coalesced + 2
+    assert shown(interface) == before + 1
+
+
+def test_focus_switches_the_panel(interface, wait_until):
+    def wait_for_panel(offset):
+        wait_until(lambda: epdconfig.image().tobytes() == canvas(offset).tobytes())
+
+    interface.request_render_image(canvas(0), app='menu')
+    wait_for_panel(0)
+    # clock doesn't have focus, its frame is only kept
+    interface.request_render_image(canvas(20), app='clock')
+    assert interface.back_frame is None
+
+    interface.focus_app('clock')
+    wait_for_panel(20)
+    interface.request_render_image(canvas(40), app='menu')
+    assert interface.back_frame is None
+    interface.focus_app('menu')
+    wait_for_panel(40)
+    assert interface.surfaces.stats()['switches'] == 2
+
+    interface.remove_app('menu')
+    wait_for_panel(20)
+
+
+def test_wrong_sized_frames_are_rejected(interface):
+    image = io.BytesIO()
+    Image.new('1', (100, 100), 255).save(image, format='PNG')
+    with pytest.raises(ValueError, match="Frame must be 250x122"):
+        interface.request_render(image.getvalue())
+    assert interface.back_frame is None
+
+
+def test_getbuffer_falls_back_to_a_whole_packed_frame(interface):
+    buffer = interface.display.getbuffer(Image.new('1', (100, 100), 255))
+    assert len(buffer) == framebuffer.linewidth(122) * 250
+
+
+def test_display_thread_survives_a_failed_frame(interface, monkeypatch, wait_until):
+    def fail(*args, **kwargs):
+        raise RuntimeError("SPI failed")
+
+    monkeypatch.setattr(interface, 'render', fail)
+    interface.request_render_image(canvas(0))
+    wait_until(lambda: interface.back_frame is None)
+    assert interface.submit(lambda: 1).result(2) == 1
+
+    monkeypatch.undo()
+    interface.request_render_image(canvas(20))
+    wait_until(lambda: epdconfig.image().tobytes() == canvas(20).tobytes())
+
+
+def test_stopped_display_thread_fails_commands(interface):
+    interface.stop_display()
+    with pytest.raises(RuntimeError, match="has stopped"):
+        interface.submit(lambda: 1).result(2)
+
+
+def test_preloading_leaves_the_display_packer_alone(interface):
+    shown = bytes(interface.display.packer.buffer)
+    image = io.BytesIO()
+    canvas(40).save(image, format='PNG')
+    interface.preload_screen('menu', image.getvalue())
+
+    assert bytes(interface.display.packer.buffer) == shown
+    assert interface.screens.get('menu') == framebuffer.FramePacker(122, 250).pack_bytes(canvas(40))
@@ -0,0 +1,98 @@
+import asyncio
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from broker import TouchEventBroker
+# epdconfig first, it picks the backend and imports the emulator itself
+from lib import epdconfig
+from lib import emulator
+from lib import epd2in13_V4
+from lib import framebuffer
+from lib import gt1151
+
+
+def sample_canvas(offset=0):
+    canvas = Image.new('1', (250, 122), 255)
+    draw = ImageDraw.Draw(canvas)
+    draw.rectangle((10 + offset, 10, 60 + offset, 60), fill=0)
+    draw.line((0, 121, 249, 0), fill=0, width=3)
+    return canvas
+
+
+@pytest.fixture
+def epd():
+    epd = epd2in13_V4.EPD()
+    epd.init(epd.FULL_UPDATE)
+    return epd
+
+
+def test_display_fills_ram_and_panel(epd):
+    canvas = sample_canvas()
+    buffer = bytes(epd.getbuffer(canvas))
+    epd.display(buffer)
+
+    assert bytes(epdconfig.implementation.ram[0x24]) == buffer
+    assert epdconfig.image().tobytes() == canvas.tobytes()
+
+
+def test_partial_window_only_rewrites_the_window(epd):
+    old = bytes(epd.getbuffer(sample_canvas()))
+    epd.displayPartBaseImage(old)
+    new = bytes(epd.getbuffer(sample_canvas(offset=4)))
+    window = framebuffer.changed_window(old, new, epd.width, epd.height)
+
+    epdconfig.reset_stats()
+    epd.init(epd.PART_UPDATE)
+    epd.displayPartialWindow(new, *window)
+
+    assert bytes(epdconfig.implementation.ram[0x24]) == new
+    assert epdconfig.image().tobytes() == sample_canvas(offset=4).tobytes()
+    stats = epdconfig.stats()
+    assert stats['refreshes'] == {'partial': 1}
+    assert stats['counters']['spi_bytes'] < len(new)
+
+
+def test_window_outside_the_data_is_left_alone(epd):
+    epd.Clear(0xFF)
+    rows = framebuffer.as_rows(bytes(epd.getbuffer(sample_canvas())), epd.width, epd.height)
+    epd.init(epd.PART_UPDATE)
+    # rows 100 to 149, bytes 2 to 9 of each
+    epd.displayPartialWindow(bytes(rows.ravel()), 16, 100, 79, 149)
+
+    ram = framebuffer.as_rows(bytes(epdconfig.implementation.ram[0x24]), epd.width, epd.height)
+    expected = np.full_like(rows, 0xFF)
+    expected[100:150, 2:10] = rows[100:150, 2:10]
+    assert (ram == expected).all()
+
+
+def test_injected_touch_is_scanned():
+    touch = gt1151.GT1151()
+    dev, old = gt1151.GT_Development(), gt1151.GT_Development()
+    epdconfig.inject_touch([(60, 120, 30), (80, 40)])
+    dev.Touch = 1
+
+    assert touch.GT_Scan(dev, old)
+    assert dev.TouchCount == 2
+    assert (dev.X[:2], dev.Y[:2], dev.S[:2]) == ([60, 80], [120, 40], [30, 20])
+    # the report is acknowledged
+    assert epdconfig.implementation.touch_registers[emulator.GT1151_STATUS] == 0
+
+
+def test_injected_touch_reaches_broker_subscribers(interface):
+    async def receive():
+        broker = TouchEventBroker()
+        broker.attach(asyncio.get_running_loop())
+        events = broker.subscribe()
+        interface.add_touch_listener(broker.publish)
+        try:
+            epdconfig.inject_touch([(60, 120)])
+            epdconfig.release_touch()
+            return [await asyncio.wait_for(events.get(), 5) for _ in range(2)]
+        finally:
+            interface.remove_touch_listener(broker.publish)
+
+    touch, release = asyncio.run(receive())
+    assert touch["is_touching"] and (touch["touch_start_x"], touch["touch_start_y"]) == (60, 120)
+    assert release["did_tap"] and (release["tap_x"], release["tap_y"]) == (60, 120)
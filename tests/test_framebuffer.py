@@ -0,0 +1,54 @@
+import numpy as np
+from PIL import Image
+
+from lib import framebuffer
+
+
+def random_canvas(size, seed=0):
+    pixels = np.random.default_rng(seed).random((size[1], size[0])) > 0.5
+    return Image.fromarray(pixels)
+
+
+def test_pack_round_trip():
+    packer = framebuffer.FramePacker(122, 250)
+    canvas = random_canvas((250, 122))
+    buffer = packer.pack_bytes(canvas)
+    assert len(buffer) == 16 * 250
+    assert packer.unpack(buffer).tobytes() == canvas.tobytes()
+
+
+def reference_pack(image):
+    # the Waveshare driver's getbuffer, before packing was vectorized
+    if image.size == (122, 250):
+        image = image.rotate(180, expand=True)
+    else:
+        image = image.rotate(270, expand=True)
+    return image.convert('1').tobytes('raw')
+
+
+def test_pack_matches_the_reference():
+    packer = framebuffer.FramePacker(122, 250)
+    for seed, size in enumerate([(122, 250), (250, 122)]):
+        canvas = random_canvas(size, seed)
+        assert packer.pack_bytes(canvas) == reference_pack(canvas)
+
+
+def test_padding_bits_are_clear():
+    packer = framebuffer.FramePacker(122, 250)
+    rows = framebuffer.as_rows(packer.pack_bytes(Image.new('1', (250, 122), 255)), 122, 250)
+    assert (rows[:, -1] == 0xC0).all()
+
+
+def test_changed_window_covers_the_change():
+    packer = framebuffer.FramePacker(122, 250)
+    old = packer.pack_bytes(Image.new('1', (250, 122), 255))
+    canvas = Image.new('1', (250, 122), 255)
+    canvas.putpixel((100, 50), 0)
+    new = packer.pack_bytes(canvas)
+    x_start, y_start, x_end, y_end = framebuffer.changed_window(old, new, 122, 250)
+    rows = framebuffer.as_rows(new, 122, 250)
+    changed = np.argwhere(rows != framebuffer.as_rows(old, 122, 250))
+    (y, byte), = changed
+    assert y_start <= y <= y_end
+    assert x_start <= byte * 8 and byte * 8 + 7 <= x_end
+    assert framebuffer.changed_window(old, old, 122, 250) is None
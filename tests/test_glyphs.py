@@ -0,0 +1,63 @@
+import os
+
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+from glyphs import GlyphAtlas
+
+
+# kerned pairs, descenders and glyphs that reach left of their origin
+KERNING = 'jg Tj AV To Wa fj jgpqy|{}'
+MULTILINE = 'Tj\njgpqy|{}\n\nAVA W.'
+
+
+def font(size):
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        pytest.skip("Pillow can't load a scalable default font")
+
+
+def reference(font, xy, text):
+    canvas = Image.new('1', (250, 122), 255)
+    ImageDraw.Draw(canvas).text(xy, text, font=font, fill=0)
+    return canvas
+
+
+def atlas_drawn(atlas, xy, text):
+    canvas = Image.new('1', (250, 122), 255)
+    atlas.draw_text(canvas, xy, text)
+    return canvas
+
+
+@pytest.mark.parametrize('size', [12, 15])
+@pytest.mark.parametrize('text', [KERNING, MULTILINE, 'x\ny z'])
+def test_matches_imagedraw(size, text):
+    atlas = GlyphAtlas(font(size))
+    for xy in ((0, 0), (5, 7), (31, 40)):
+        expected = reference(atlas.font, xy, text)
+        assert atlas_drawn(atlas, xy, text).tobytes() == expected.tobytes()
+        # and again from the cache
+        assert atlas_drawn(atlas, xy, text).tobytes() == expected.tobytes()
+
+
+def test_lines_are_evicted():
+    atlas = GlyphAtlas(font(12), max_lines=2)
+    for text in ('a', 'b', 'a', 'c'):
+        atlas.line(text)
+    assert list(atlas.lines) == ['a', 'c']
+
+
+def test_cache_follows_the_font_file(tmp_path, monkeypatch):
+    monkeypatch.setattr('glyphs.cachedir', str(tmp_path))
+    path = tmp_path / 'font.ttf'
+    path.write_bytes(font(15).font_bytes)
+    atlas = GlyphAtlas(ImageFont.truetype(str(path), 15))
+    atlas.line('cached')
+    atlas.save()
+    assert 'cached' in GlyphAtlas(ImageFont.truetype(str(path), 15)).lines
+
+    # a replaced font file has a new key, its old lines aren't reused
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert 'cached' not in GlyphAtlas(ImageFont.truetype(str(path), 15)).lines
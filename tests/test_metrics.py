@@ -0,0 +1,21 @@
+from lib import metrics
+
+
+def test_counter_lines_use_the_total_name():
+    counter = metrics.Counter('epd_frames', 'Frames.', ['outcome'])
+    counter.labels('full').inc(2)
+    assert counter.expose() == ['# HELP epd_frames_total Frames.',
+                                '# TYPE epd_frames_total counter',
+                                'epd_frames_total{outcome="full"} 2']
+
+
+def test_histogram_lines():
+    histogram = metrics.Histogram('epd_pack_seconds', 'Packing.', buckets=(0.1, 1.0))
+    histogram.observe(0.5)
+    assert histogram.expose() == ['# HELP epd_pack_seconds Packing.',
+                                  '# TYPE epd_pack_seconds histogram',
+                                  'epd_pack_seconds_bucket{le="0.1"} 0',
+                                  'epd_pack_seconds_bucket{le="1.0"} 1',
+                                  'epd_pack_seconds_bucket{le="+Inf"} 1',
+                                  'epd_pack_seconds_sum 0.5',
+                                  'epd_pack_seconds_count 1']
@@ -0,0 +1,69 @@
+import time
+
+from lib import epdconfig
+
+
+def step(interface):
+    # display_step belongs to the display thread, run it there
+    interface.submit(interface.display_step, None).result(5)
+    return epdconfig.stats()['refreshes'].get('full', 0)
+
+
+def idle(interface, seconds):
+    interface.last_touched = time.time() - seconds
+
+
+def test_ghosting_budget_waits_for_an_idle_moment(interface):
+    full = step(interface)
+    interface.ghosting_pixels = interface.GHOSTING_BUDGET
+    idle(interface, 0)
+    assert step(interface) == full
+    assert interface.ghosting_pixels == interface.GHOSTING_BUDGET
+
+    idle(interface, interface.IDLE_INTERVAL + 1)
+    assert step(interface) == full + 1
+    assert interface.ghosting_pixels == 0
+
+
+def test_max_refresh_interval(interface):
+    full = step(interface)
+    interface.ghosting_pixels = 10
+    interface.last_full_refresh = time.time() - interface.MAX_REFRESH_INTERVAL - 1
+    assert step(interface) == full + 1
+    # nothing changed since, nothing to clean up
+    interface.last_full_refresh = time.time() - interface.MAX_REFRESH_INTERVAL - 1
+    assert step(interface) == full + 1
+
+
+def test_max_refresh_interval_leaves_a_sleeping_panel_alone(interface):
+    # long enough without a touch that the panel stays asleep
+    idle(interface, interface.TIMEOUT_INTERVAL + 1)
+    interface.submit(interface.sleep, False).result(5)
+    assert epdconfig.implementation.sleeping
+    full = step(interface)
+    interface.ghosting_pixels = 10
+    interface.last_full_refresh = time.time() - interface.MAX_REFRESH_INTERVAL - 1
+
+    assert step(interface) == full
+    assert epdconfig.implementation.sleeping
+    assert not interface.screen_is_active
+
+
+def test_stale_wake_request_does_not_spin(interface, monkeypatch):
+    steps = []
+    display_step = interface.display_step
+    monkeypatch.setattr(interface, 'display_step', lambda frame: steps.append(frame) or display_step(frame))
+    with interface.render_condition:
+        interface.wake_requested = True
+        interface.render_condition.notify()
+    time.sleep(0.3)
+    # the loop only wakes for the notify and the periodic housekeeping
+    assert len(steps) <= 2
+
+
+def test_touch_while_awake_requests_no_wake(interface, wait_until):
+    events = []
+    interface.add_touch_listener(events.append)
+    epdconfig.inject_touch([(60, 120)])
+    wait_until(lambda: events)
+    assert not interface.wake_requested
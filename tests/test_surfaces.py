@@ -0,0 +1,40 @@
+import pytest
+from PIL import Image
+
+from lib import framebuffer
+from surfaces import SurfaceManager
+
+
+def frame(value):
+    return bytes([value]) * (framebuffer.linewidth(122) * 250)
+
+
+@pytest.fixture
+def surfaces():
+    return SurfaceManager(framebuffer.FramePacker(122, 250))
+
+
+def test_only_frames_create_surfaces(surfaces):
+    with pytest.raises(ValueError, match="No surface for app menu"):
+        surfaces.focus('menu')
+    assert surfaces.canvas('menu').getextrema() == (255, 255)
+    assert surfaces.stats()['order'] == []
+
+    assert surfaces.update('menu', frame(0x00))
+    assert surfaces.focus('menu') == frame(0x00)
+
+
+def test_removing_the_last_app_shows_a_blank_frame(surfaces):
+    surfaces.update('menu', frame(0x00))
+    surfaces.update('clock', frame(0x0F))
+    surfaces.focus('clock')
+
+    assert surfaces.remove('menu') is None
+    assert surfaces.remove('clock') == surfaces.blank()
+    with pytest.raises(ValueError):
+        surfaces.remove('clock')
+
+
+def test_blank_frame_matches_a_packed_white_canvas(surfaces):
+    white = surfaces.packer.pack_bytes(Image.new('1', (250, 122), 255))
+    assert surfaces.blank() == white
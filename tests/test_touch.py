@@ -0,0 +1,50 @@
+from lib import epdconfig
+
+
+def tap(x, y):
+    epdconfig.inject_touch([(x, y)])
+    epdconfig.release_touch()
+
+
+def test_poll_reports_a_tap_once(interface, wait_until):
+    events = []
+    interface.add_touch_listener(events.append)
+    tap(60, 120)
+    wait_until(lambda: any(event["did_tap"] for event in events))
+
+    first = interface.detect_screen_interaction()
+    assert (first["did_tap"], first["tap_x"], first["tap_y"]) == (True, 60, 120)
+    assert not interface.detect_screen_interaction()["did_tap"]
+
+
+def test_poll_keeps_a_tap_followed_by_other_samples(interface, wait_until):
+    events = []
+    interface.add_touch_listener(events.append)
+    tap(60, 120)
+    epdconfig.inject_touch([(70, 100)])
+    wait_until(lambda: len(events) == 3)
+
+    state = interface.detect_screen_interaction()
+    assert state["did_tap"] and state["is_touching"]
+
+
+def test_events_follow_the_app_on_the_panel(interface, wait_until):
+    events = []
+    interface.add_touch_listener(events.append)
+    blank = bytes(interface.display.getbuffer(interface.canvas))
+
+    interface.request_render_buffer(blank, app='menu')
+    tap(60, 120)
+    wait_until(lambda: len(events) == 2)
+    assert events[-1]["app"] == 'menu'
+
+    # a frame without an app takes the panel from it
+    interface.request_render_buffer(blank)
+    tap(60, 120)
+    wait_until(lambda: len(events) == 4)
+    assert events[-1]["app"] is None
+
+    interface.focus_app('menu')
+    tap(60, 120)
+    wait_until(lambda: len(events) == 6)
+    assert events[-1]["app"] == 'menu'
@@ -0,0 +1,70 @@
+import asyncio
+
+
+class HardwareWorker:
+    # Async facade over EPaperInterface for the API handlers. Panel calls are
+    # queued onto the interface's display thread, which already owns the SPI
+    # bus, so a handler awaits a future instead of blocking the event loop
+    # through delay_ms, ReadBusy or I2C reads.
+
+    def __init__(self, interface):
+        self.interface = interface
+
+    async def call(self, command, *args):
+        return await asyncio.wrap_future(self.interface.submit(command, *args))
+
+    async def sleep(self):
+        return await self.call(self.interface.sleep)
+
+    async def awaken(self):
+        return await self.call(self.interface.awaken)
+
+    async def clear_screen(self):
+        return await self.call(self.interface.clear_screen)
+
+    async def reset_canvas(self):
+        return await self.call(self.interface.reset_canvas)
+
+    async def request_render_image(self, image, profile=None, trace_id=None, app=None):
+        # app frames are packed here to be kept as the app's surface
+        if app is not None:
+            return await asyncio.to_thread(
+                self.interface.request_render_image, image, profile, trace_id, app)
+        return self.interface.request_render_image(image, profile, trace_id)
+
+    async def request_render_buffer(self, buffer, profile=None, trace_id=None, app=None):
+        # no decoding to do, this only validates and queues the frame
+        return self.interface.request_render_buffer(buffer, profile, trace_id, app)
+
+    async def draw(self, commands, profile=None, trace_id=None, app=None):
+        return await asyncio.to_thread(self.interface.draw, commands, profile, trace_id, app)
+
+    async def update_layer(self, name, image_data, z=0, opaque_box=None, profile=None):
+        return await asyncio.to_thread(
+            self.interface.update_layer, name, image_data, z, opaque_box, profile)
+
+    async def draw_layer(self, name, commands, z=None, opaque_box=None, profile=None):
+        return await asyncio.to_thread(
+            self.interface.draw_layer, name, commands, z, opaque_box, profile)
+
+    async def remove_layer(self, name, profile=None):
+        return await asyncio.to_thread(self.interface.remove_layer, name, profile)
+
+    async def preload_screen(self, name, image_data):
+        return await asyncio.to_thread(self.interface.preload_screen, name, image_data)
+
+    async def display_screen(self, name, profile=None, app=None):
+        return self.interface.display_screen(name, profile, app)
+
+    async def focus_app(self, app, profile=None):
+        return self.interface.focus_app(app, profile)
+
+    async def remove_app(self, app, profile=None):
+        return self.interface.remove_app(app, profile)
+
+    async def shutdown(self):
+        # shutdown stops and joins the display thread, so it can't run there
+        return await asyncio.to_thread(self.interface.shutdown)
+
+    async def detect_screen_interaction(self):
+        return self.interface.detect_screen_interaction()